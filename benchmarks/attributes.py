@@ -0,0 +1,103 @@
+'''
+Compares the attribute dictionary parser with the regex and eval based one
+it replaced.
+
+    python benchmarks/attributes.py [repeat]
+
+Each case is parsed by both implementations, which must give the same
+attributes, and the time per element is reported. The order of the attributes
+differs: the parser keeps the order they are written in, while eval gave the
+order of a dict.
+'''
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hamlpy.elements import Element
+
+CASES = [
+    ('short', u"{'href': '/'}"),
+    ('typical', u"{'href': '/items/{{ item.id }}/', 'title': 'Item', 'data-id': 42, 'class': ['item', 'active'], 'checked': None}"),
+    ('ruby', u"{:href => '/', :title => \"Home\", :rel => 'nofollow'}"),
+    ('django tags', u"{'href': \"{% url 'item' item.id %}\", 'title': \"{% trans 'It\\'s here' %}\"}"),
+    ('many', u'{%s}' % u', '.join(u"'data-a%d': 'value %d'" % (i, i) for i in range(200))),
+    ('long value', u"{'style': '%s'}" % (u"color: red; " * 2000)),
+    ('quotes', u"{'title': \"%s\"}" % (u"it's " * 2000)),
+]
+
+
+class LegacyElement(Element):
+    '''The attribute parsing of Element before it had its own parser'''
+    _ATTRIBUTE_KEY_REGEX = r'(?P<key>[a-zA-Z_][a-zA-Z0-9_-]*)'
+    _SINGLE_QUOTE_STRING_LITERAL_REGEX = r"'([^'\\]*(?:\\.[^'\\]*)*)'"
+    _DOUBLE_QUOTE_STRING_LITERAL_REGEX = r'"([^"\\]*(?:\\.[^"\\]*)*)"'
+    _ATTRIBUTE_VALUE_REGEX = r'(?P<val>\d+|None(?!\w)|%s|%s)' % (_SINGLE_QUOTE_STRING_LITERAL_REGEX, _DOUBLE_QUOTE_STRING_LITERAL_REGEX)
+
+    RUBY_HAML_REGEX = re.compile(r'(:|\")%s(\"|) =>' % (_ATTRIBUTE_KEY_REGEX))
+    ATTRIBUTE_REGEX = re.compile(r'(?P<pre>\{\s*|,\s*)%s\s*:\s*%s' % (_ATTRIBUTE_KEY_REGEX, _ATTRIBUTE_VALUE_REGEX), re.UNICODE)
+
+    def _escape_attribute_quotes(self, v):
+        escaped = []
+        inside_tag = False
+        for i, _ in enumerate(v):
+            if v[i:i + 2] == '{%':
+                inside_tag = True
+            elif v[i:i + 2] == '%}':
+                inside_tag = False
+            if v[i] == self.attr_wrapper and not inside_tag:
+                escaped.append('\\')
+            escaped.append(v[i])
+        return ''.join(escaped)
+
+    def _parse_attribute_dictionary(self, attribute_dict_string):
+        attributes_dict = {}
+        if attribute_dict_string:
+            attribute_dict_string = attribute_dict_string.replace('\n', ' ')
+            attribute_dict_string = re.sub(self.RUBY_HAML_REGEX, '"\g<key>":', attribute_dict_string)
+            attribute_dict_string = re.sub(self.ATTRIBUTE_REGEX, '\g<pre>"\g<key>":\g<val>', attribute_dict_string)
+            attributes_dict = eval(attribute_dict_string)
+            for k, v in attributes_dict.items():
+                if k != 'id' and k != 'class':
+                    if v is None:
+                        self.attributes += "%s " % (k,)
+                    elif isinstance(v, int) or isinstance(v, float):
+                        self.attributes += "%s=%s " % (k, self.attr_wrap(v))
+                    else:
+                        v = re.sub(self.DJANGO_VARIABLE_REGEX, '{{\g<variable>}}', attributes_dict[k])
+                        attributes_dict[k] = v
+                        v = v.decode('utf-8')
+                        self.attributes += "%s=%s " % (k, self.attr_wrap(self._escape_attribute_quotes(v)))
+            self.attributes = self.attributes.strip()
+        return attributes_dict
+
+
+# One rendered attribute, e.g. title='it\'s' or checked
+ATTRIBUTE = re.compile(r"[^\s=]+(?:='(?:[^'\\]|\\.)*')?")
+
+
+def attribute_set(attributes):
+    return sorted(ATTRIBUTE.findall(attributes))
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print '%-12s %12s %12s %8s' % ('case', 'eval (us)', 'parser (us)', 'speedup')
+    for name, attributes in CASES:
+        haml = u'%a' + attributes + u' text'
+        legacy, current = LegacyElement(haml), Element(haml)
+        assert attribute_set(legacy.attributes) == attribute_set(current.attributes), name
+        assert (legacy.id, legacy.classes) == (current.id, current.classes), name
+
+        number = max(1, 20000 // len(haml))
+        timings = []
+        for cls in (LegacyElement, Element):
+            best = min(timeit.repeat(lambda: cls(haml), number=number, repeat=repeat))
+            timings.append(best / number * 1e6)
+        print '%-12s %12.1f %12.1f %7.1fx' % (name, timings[0], timings[1], timings[0] / timings[1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''
+Compares Element.split_haml with the regex it replaced on long element lines.
+
+    python benchmarks/element_header.py [repeat]
+
+Both must split every case the same way, except where the regex ran the
+attributes to the last brace of the line, which split_haml ends at the brace
+closing them. Each case is timed at three sizes, ten times apart, to show the
+time grows linearly.
+'''
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hamlpy.elements import Element
+
+HAML_REGEX = re.compile(r"""
+    (?P<tag>%\w+(\:\w+)?)?
+    (?P<id>\#[\w-]*)?
+    (?P<class>\.[\w\.-]*)*
+    (?P<attributes>\{.*\})?
+    (?P<nuke_outer_whitespace>\>)?
+    (?P<nuke_inner_whitespace>\<)?
+    (?P<selfclose>/)?
+    (?P<django>=)?
+    (?P<inline>[^\w\.#\{].*)?
+    """, re.X | re.MULTILINE | re.DOTALL | re.UNICODE)
+
+# The parts both split the same way when braces follow the attributes
+HEAD_PARTS = ('tag', 'id', 'class')
+
+
+def cases(n):
+    '''Returns the name, the line and the parts both must agree on (None for
+    all of them) of each case'''
+    return [
+        ('simple', u"%a#home.nav.active{'href': '/'} Home", None),
+        ('long attributes', u"%div{" + u',\n     '.join(u"'data-a%d': 'value %d'" % (i, i) for i in range(n)) + u'}', None),
+        ('unclosed brace', u"%div{" + u"'a': 'b', " * n, None),
+        ('long classes', u"%div" + u".class-name" * n + u" text", None),
+        ('long inline', u"%p " + u"word {braces} " * n, None),
+        ('braces after', u"%p{'a': 'b'}" + u" } " * n, HEAD_PARTS),
+    ]
+
+
+def split_parts(split, parts):
+    if parts is None:
+        return split
+    return dict((part, split[part]) for part in parts)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print '%-16s %7s %10s %12s %8s' % ('case', 'chars', 'regex (us)', 'scanner (us)', 'speedup')
+    for n in (500, 5000, 50000):
+        for name, haml, parts in cases(n):
+            if name == 'simple' and n != 500:
+                continue
+            regex_split = split_parts(HAML_REGEX.search(haml).groupdict(''), parts)
+            assert regex_split == split_parts(Element.split_haml(haml), parts), name
+
+            number = max(1, 1000000 // len(haml))
+            regex = min(timeit.repeat(lambda: HAML_REGEX.search(haml).groupdict(''), number=number, repeat=repeat))
+            scanner = min(timeit.repeat(lambda: Element.split_haml(haml), number=number, repeat=repeat))
+            print '%-16s %7d %10.1f %12.1f %7.1fx' % (
+                name, len(haml), regex / number * 1e6, scanner / number * 1e6, regex / scanner)
+
+
+if __name__ == '__main__':
+    main()
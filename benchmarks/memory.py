@@ -0,0 +1,95 @@
+'''
+Measures the memory taken by the node tree of a large generated template.
+
+    python benchmarks/memory.py [lines]
+
+Reports the size of the node objects (including their attribute dicts and
+elements, if they have any), the growth of the process' peak resident set
+and the time taken to build and render the tree.
+'''
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hamlpy import nodes
+
+BLOCK = u'''\
+%div.section{'id': 'section-{n}'}
+  %h2.title Section {n}
+  - if items
+    %ul.items
+      - for item in items
+        %li.item{'data-n': '{n}'}>
+          %a{'href': '/items/{n}/'}= item.name
+          %span.price ={item.price}
+      - empty
+        %li.empty Nothing here
+  - else
+    %p
+      No items in section {n}, see
+      %a{'href': '/help/'} help
+  -# comment {n}
+'''
+
+
+def generate(lines):
+    block_lines = len(BLOCK.splitlines())
+    return u''.join(BLOCK.replace(u'{n}', unicode(n)) for n in range(lines // block_lines + 1))
+
+
+def object_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def tree_size(root):
+    count = 0
+    size = 0
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        count += 1
+        size += object_size(node) + sys.getsizeof(node.children)
+        element = getattr(node, 'element', None)
+        if element is not None:
+            size += object_size(element)
+        pending.extend(node.children)
+    return count, size
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    haml_lines = generate(lines).splitlines()
+
+    rss_before = peak_rss_kb()
+    start = time.time()
+    root = nodes.RootNode()
+    cursor = nodes.TreeCursor(root)
+    for line in haml_lines:
+        node = nodes.create_node(line)
+        if node:
+            cursor.add_node(node)
+    built = time.time()
+    root.render()
+    rendered = time.time()
+
+    count, size = tree_size(root)
+    print 'lines:            %d' % len(haml_lines)
+    print 'nodes:            %d' % count
+    print 'node objects:     %.1f MB (%d bytes per node)' % (size / 1e6, size // count)
+    print 'peak RSS growth:  %.1f MB' % ((peak_rss_kb() - rss_before) / 1024.0)
+    print 'build:            %.2f s' % (built - start)
+    print 'render:           %.2f s' % (rendered - built)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+Measures rendering a large generated template full of whitespace removal.
+
+    python benchmarks/render.py [lines] [repeat]
+
+Builds the tree once per run and reports the best time taken by
+RootNode.render, which renders the nodes, removes whitespace around and
+inside elements marked with > and <, and joins the HTML.
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hamlpy import hamlpy, nodes
+from hamlpy.lexer import tokenize
+
+BLOCK = u'''\
+%ul.list{n}<
+  %li> first
+  %li.item>
+    %a{'href': '/{n}/'}< link {n}
+    %span> ={n}
+  - for item in items
+    %li>= item
+  %li
+    text {n}
+    %b> bold
+    more text
+%p<
+  :plain
+    plain {n}
+'''
+
+
+def generate(lines):
+    block_lines = len(BLOCK.splitlines())
+    return u''.join(BLOCK.replace(u'{n}', unicode(n)) for n in range(lines // block_lines + 1))
+
+
+def build(haml):
+    root = nodes.RootNode()
+    cursor = nodes.TreeCursor(root)
+    for token in tokenize(haml.split('\n')):
+        if token.kind is not None:
+            cursor.add_node(token.node())
+    return root
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    haml = generate(lines)
+
+    best = None
+    for i in range(repeat):
+        root = build(haml)
+        start = time.time()
+        html = root.render()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    assert html == hamlpy.Compiler().process(haml)
+    print 'lines:  %d' % len(haml.splitlines())
+    print 'output: %d characters' % len(html)
+    print 'render: %.3f s (best of %d)' % (best, repeat)
+
+
+if __name__ == '__main__':
+    main()
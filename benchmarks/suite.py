@@ -0,0 +1,241 @@
+'''
+Times the compiler on generated templates, each growing along one axis:
+
+    lines       a realistic mix of elements, tags and comments
+    depth       elements nested inside each other
+    fanout      siblings inside one element, some removing whitespace
+    attributes  elements with large multi-line attribute dictionaries
+    filters     :javascript, :css and :plain blocks
+    variables   text full of inline variables
+
+    python benchmarks/suite.py [-o results.json] [--axis AXIS] [--scale F] [--repeat N]
+    python benchmarks/suite.py --compare before.json after.json
+
+Every template is compiled in a fresh process, which reports the best time of
+each phase (tokenizing, building the tree and rendering), the lines compiled
+per second and the growth of its peak resident set. Results are written as
+JSON, so runs on two revisions can be compared.
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from hamlpy import hamlpy
+from hamlpy.lexer import tokenize
+
+LINES_BLOCK = u'''\
+%div.section{'id': 'section-{n}'}
+  %h2.title Section {n}
+  - if items
+    %ul.items
+      - for item in items
+        %li.item{'data-n': '{n}'}>
+          %a{'href': '/items/{n}/'}= item.name
+      - empty
+        %li.empty Nothing here
+  - else
+    %p
+      No items in section {n}, see
+      %a{'href': '/help/'} help
+  -# comment {n}
+'''
+
+FILTER_BLOCK = u'''\
+:javascript
+  var section{n} = document.getElementById('section-{n}');
+  section{n}.className = 'loaded';
+:css
+  #section-{n} { color: red; }
+%p
+  :plain
+    Plain text {n} with <b>markup</b>
+'''
+
+
+def generate_lines(n):
+    block_lines = len(LINES_BLOCK.splitlines())
+    return u''.join(LINES_BLOCK.replace(u'{n}', unicode(i)) for i in range(n // block_lines + 1))
+
+
+def generate_depth(n):
+    return u'\n'.join(u' ' * i + u'%div.level' for i in range(n))
+
+
+def generate_fanout(n):
+    return u'%ul.list\n' + u''.join(
+        u'  %%li.item%s item %d\n' % (u'>' if i % 3 == 0 else u'', i) for i in range(n))
+
+
+def generate_attributes(n):
+    block = u'%div{' + u',\n     '.join(u"'data-a%d': 'value {n} %d'" % (i, i) for i in range(n)) + u'}\n'
+    return u''.join(block.replace(u'{n}', unicode(i)) for i in range(10))
+
+
+def generate_filters(n):
+    block_lines = len(FILTER_BLOCK.splitlines())
+    return u''.join(FILTER_BLOCK.replace(u'{n}', unicode(i)) for i in range(n // block_lines + 1))
+
+
+def generate_variables(n):
+    return u'%div\n' + u''.join(
+        u'  Dear #{user.name}, item #{item%d.name} costs ={item%d.price} \\#{not} %d\n' % (i, i, i)
+        for i in range(n))
+
+
+# Generators and default sizes of every axis, each size twice the last
+AXES = [
+    ('lines', generate_lines, (5000, 10000, 20000)),
+    ('depth', generate_depth, (500, 1000, 2000)),
+    ('fanout', generate_fanout, (5000, 10000, 20000)),
+    ('attributes', generate_attributes, (250, 500, 1000)),
+    ('filters', generate_filters, (5000, 10000, 20000)),
+    ('variables', generate_variables, (5000, 10000, 20000)),
+]
+
+
+def peak_rss_kb():
+    # Kilobytes on Linux, bytes on OS X
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def compile_phases(haml):
+    '''Compiles haml with the steps of Compiler.process, returning the HTML
+    and the time taken by each phase. The nodes are not timed one by one as
+    with on_stats, which would slow down rendering.'''
+    compiler = hamlpy.Compiler()
+    start = time.time()
+    tokens = list(tokenize(haml.split('\n')))
+    tokenized = time.time()
+
+    root = compiler._build_tree(tokens)
+    built = time.time()
+
+    html = root.render()
+    rendered = time.time()
+    return html, {'tokenize': tokenized - start, 'build': built - tokenized, 'render': rendered - built}
+
+
+def run_case(axis, size, repeat):
+    '''Runs in the process measuring one template'''
+    generate = dict((name, generate) for name, generate, sizes in AXES)[axis]
+    haml = generate(size)
+    baseline = peak_rss_kb()
+
+    best = {}
+    for i in range(repeat):
+        html, phases = compile_phases(haml)
+        for phase, elapsed in phases.items():
+            best[phase] = min(best.get(phase, elapsed), elapsed)
+    peak_growth = peak_rss_kb() - baseline
+    assert html == hamlpy.Compiler().process(haml), 'phases differ from Compiler.process'
+
+    total = sum(best.values())
+    lines = len(haml.splitlines())
+    return {
+        'axis': axis,
+        'size': size,
+        'lines': lines,
+        'source_bytes': len(haml.encode('utf-8')),
+        'output_bytes': len(html.encode('utf-8')),
+        'phases': best,
+        'total': total,
+        'lines_per_sec': lines / total if total else None,
+        'peak_rss_growth_kb': peak_growth,
+    }
+
+
+def run_suite(axes, scale, repeat):
+    results = []
+    for axis, generate, sizes in AXES:
+        if axes and axis not in axes:
+            continue
+        for size in sizes:
+            size = max(1, int(size * scale))
+            output = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), '--run', axis, str(size), '--repeat', str(repeat)])
+            result = json.loads(output)
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    phases = result['phases']
+    print '%-10s %6d %7d lines %8.3f s (tokenize %.3f, build %.3f, render %.3f) %9.0f lines/s %8.1f MB' % (
+        result['axis'], result['size'], result['lines'], result['total'], phases['tokenize'],
+        phases['build'], phases['render'], result['lines_per_sec'] or 0, result['peak_rss_growth_kb'] / 1024.0)
+
+
+def compare(before_path, after_path):
+    with open(before_path) as before_file:
+        before = json.load(before_file)
+    with open(after_path) as after_file:
+        after = json.load(after_file)
+    print 'before: %s (%s)' % (before_path, before.get('revision'))
+    print 'after:  %s (%s)' % (after_path, after.get('revision'))
+
+    previous = dict(((result['axis'], result['size']), result) for result in before['results'])
+    print '%-10s %6s %10s %10s %7s %10s %10s %7s' % (
+        'axis', 'size', 'before s', 'after s', 'time', 'before MB', 'after MB', 'memory')
+    for result in after['results']:
+        old = previous.get((result['axis'], result['size']))
+        if old is None:
+            continue
+        print '%-10s %6d %10.3f %10.3f %6.2fx %10.1f %10.1f %6.2fx' % (
+            result['axis'], result['size'], old['total'], result['total'], ratio(result['total'], old['total']),
+            old['peak_rss_growth_kb'] / 1024.0, result['peak_rss_growth_kb'] / 1024.0,
+            ratio(result['peak_rss_growth_kb'], old['peak_rss_growth_kb']))
+
+
+def ratio(after, before):
+    return float(after) / before if before else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the compiler on generated templates.')
+    parser.add_argument('-o', '--output', metavar='FILE', help='Write the results to FILE as JSON')
+    parser.add_argument('--axis', action='append', choices=[axis for axis, generate, sizes in AXES],
+                        help='Only run the given axis. Can be given more than once')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply the sizes of the templates by this')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to compile each template')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two result files')
+    parser.add_argument('--run', nargs=2, metavar=('AXIS', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print json.dumps(run_case(args.run[0], int(args.run[1]), args.repeat))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run_suite(args.axis, args.scale, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'revision': revision(),
+                'python': platform.python_version(),
+                'repeat': args.repeat,
+                'results': results,
+            }, output, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+'''
+Parser for the attribute dictionaries of elements, e.g.
+
+    %a{'href': '/', :title => "Home", class: ['nav', 'active'], checked: None}
+
+Keys can be quoted, bare or Ruby symbols, and are separated from their values
+by ':' or '=>'. Strings can have a u prefix, which is ignored. Values can be strings, numbers, None, True, False and lists or
+tuples of those. Only literals are accepted, so templates can't run Python
+code, and every part of the dictionary is read exactly once.
+'''
+import re
+from collections import OrderedDict
+
+
+class AttributeDictError(ValueError):
+    pass
+
+
+# Every token is preceded by optional whitespace, and matches one of the
+# groups, which tell its kind. Empty strings are the only tokens matching none.
+_TOKENS = re.compile(r'''\s*(?:
+    (=>|[{}\[\](),:])
+    # Single and double quote regexes from: http://stackoverflow.com/a/5453821/281469
+    |[uU]?'([^'\\]*(?:\\.[^'\\]*)*)'
+    |[uU]?"([^"\\]*(?:\\.[^"\\]*)*)"
+    |([a-zA-Z_][a-zA-Z0-9_-]*)
+    |([-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+    |(\S)
+)''', re.VERBOSE | re.DOTALL)
+_PUNCTUATION, _SINGLE_QUOTED, _DOUBLE_QUOTED, _NAME, _NUMBER, _INVALID = range(6)
+# Follows the last token, so the parser can always look at the next one
+_END = ('', '', '', '', '', None)
+
+_CONSTANTS = {'None': None, 'True': True, 'False': False}
+_CLOSING = {'[': ']', '(': ')'}
+
+# Characters that can change the brace depth of a line, see brace_depth
+_BRACE_CHARACTERS = re.compile(r'''[{}'"\\]''')
+# Text without braces, in which strings are skipped whole, see closing_brace
+_NO_BRACES = re.compile(r'''(?:[^{}'"]+|'[^'\\]*(?:\\.[^'\\]*)*'|"[^"\\]*(?:\\.[^"\\]*)*")*''', re.DOTALL)
+
+
+def parse_attribute_dict(text):
+    '''Returns the dictionary written in text. Raises AttributeDictError if
+    text is not a dictionary of literals.'''
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    tokens = _TOKENS.findall(text)
+    tokens.append(_END)
+    return _Parser(text, tokens).parse()
+
+
+def brace_depth(line, depth=0, quote=None):
+    '''Returns the number of braces left open after line, and the quote
+    character of the string left open, if any. A line continuing earlier ones
+    is given the depth and quote they ended with.
+
+    Braces in strings don't count, and strings only start inside braces, so
+    apostrophes in text don't start one.'''
+    escaped = -1
+    for match in _BRACE_CHARACTERS.finditer(line):
+        position = match.start()
+        if position == escaped:
+            continue
+        character = match.group()
+        if quote:
+            if character == '\\':
+                escaped = position + 1
+            elif character == quote:
+                quote = None
+        elif character == '{':
+            depth += 1
+        elif character == '}':
+            depth -= 1
+        elif depth > 0 and character != '\\':
+            quote = character
+    return depth, quote
+
+
+def closing_brace(text, start):
+    '''Returns the index of the brace closing the one at start, or -1 if it
+    isn't closed. Braces in strings don't count, as for brace_depth.'''
+    depth = 1
+    position = start + 1
+    # Every string is inside the brace, so the text between braces can be
+    # skipped at once
+    while True:
+        position = _NO_BRACES.match(text, position).end()
+        if position == len(text) or text[position] in '\'"':
+            # The end, or a string running to it
+            return -1
+        if text[position] == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return position
+        position += 1
+
+
+def _is_string(token):
+    return token[_SINGLE_QUOTED] or token[_DOUBLE_QUOTED] or not (
+        token[_PUNCTUATION] or token[_NAME] or token[_NUMBER] or token[_INVALID] or token is _END)
+
+
+class _Parser(object):
+    def __init__(self, text, tokens):
+        self.text = text
+        self.tokens = tokens
+        self.index = 0
+
+    def parse(self):
+        attributes = []
+        self._expect('{')
+        if not self._accept('}'):
+            while True:
+                key = self._key()
+                if not (self._accept(':') or self._accept('=>')):
+                    self._fail("':' or '=>'")
+                attributes.append((key, self._value()))
+                if not self._accept(','):
+                    self._expect('}')
+                    break
+                if self._accept('}'):
+                    break
+        if self.tokens[self.index] is not _END:
+            self._fail('end of dictionary')
+        # Attributes are rendered in the order they are written in
+        return OrderedDict(attributes)
+
+    def _key(self):
+        # Ruby symbols, e.g. :href
+        self._accept(':')
+        token = self.tokens[self.index]
+        if token[_NAME]:
+            self.index += 1
+            return token[_NAME]
+        if _is_string(token):
+            self.index += 1
+            return _unescape(token)
+        self._fail('attribute name')
+
+    def _value(self):
+        token = self.tokens[self.index]
+        if _is_string(token):
+            value = _unescape(token)
+            self.index += 1
+            # Adjacent strings are joined, as in Python
+            while _is_string(self.tokens[self.index]):
+                value += _unescape(self.tokens[self.index])
+                self.index += 1
+            return value
+        if token[_NUMBER]:
+            self.index += 1
+            if token[_NUMBER].lstrip('-+').isdigit():
+                return int(token[_NUMBER])
+            return float(token[_NUMBER])
+        if token[_NAME] in _CONSTANTS:
+            self.index += 1
+            return _CONSTANTS[token[_NAME]]
+        if token[_PUNCTUATION] in _CLOSING:
+            self.index += 1
+            return self._sequence(token[_PUNCTUATION])
+        self._fail('value')
+
+    def _sequence(self, opening):
+        closing = _CLOSING[opening]
+        items = []
+        trailing_comma = False
+        while not self._accept(closing):
+            items.append(self._value())
+            trailing_comma = self._accept(',')
+            if not trailing_comma:
+                self._expect(closing)
+                break
+        if opening == '(':
+            # A parenthesized value is not a tuple without a comma
+            if len(items) == 1 and not trailing_comma:
+                return items[0]
+            return tuple(items)
+        return items
+
+    def _accept(self, punctuation):
+        if self.tokens[self.index][_PUNCTUATION] == punctuation:
+            self.index += 1
+            return True
+        return False
+
+    def _expect(self, punctuation):
+        if not self._accept(punctuation):
+            self._fail("'%s'" % punctuation)
+
+    def _fail(self, expected):
+        token = self.tokens[self.index]
+        found = 'end' if token is _END else repr(''.join(token))
+        raise AttributeDictError('expected %s instead of %s in %s' % (expected, found, self.text))
+
+
+def _unescape(token):
+    text = token[_SINGLE_QUOTED] or token[_DOUBLE_QUOTED]
+    if '\\' in text:
+        # Same escapes as Python string literals
+        return text.encode('utf-8').decode('string_escape').decode('utf-8')
+    return text
@@ -0,0 +1,203 @@
+'''
+Compiles whole trees of HamlPy templates ahead of time.
+
+Every .haml/.hamlpy file below the given source folders is compiled by a pool
+of worker processes. A manifest records the content hash (see
+hamlpy.cache.cache_key) and output of every template, so later builds only
+compile templates whose source or compiler options changed, and loaders can
+serve the prebuilt HTML without compiling it again.
+'''
+import argparse
+import codecs
+import json
+import multiprocessing
+import os
+import sys
+
+import hamlpy
+import nodes as hamlpynodes
+from cache import cache_key, settings_key
+from cli import StoreNameValueTagPair, init_worker
+from manifest import MANIFEST_NAME, MANIFEST_VERSION, load_manifest
+from utils import atomic_write
+
+arg_parser = argparse.ArgumentParser(description='Compile all HamlPy templates below the given folders.')
+arg_parser.add_argument('source_dirs', metavar='source_dir', nargs='+', help='Folder to compile templates from')
+arg_parser.add_argument('-o', '--output-dir', dest='output_dir', metavar='DIR', help='Destination folder. Templates are compiled next to their source by default')
+arg_parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help='Number of templates to compile in parallel. Defaults to the number of CPUs')
+arg_parser.add_argument('-ext', '--extension', metavar='EXT', default='.html', help='The output file extension. Default is .html')
+arg_parser.add_argument('-m', '--manifest', metavar='FILE', help='Path of the build manifest. Defaults to %s in the destination folder' % MANIFEST_NAME)
+arg_parser.add_argument('-v', '--verbose', action='store_true', help='List every compiled template')
+arg_parser.add_argument('--tag', type=str, nargs=1, action=StoreNameValueTagPair, help='Add self closing tag. eg. --tag macro:endmacro')
+arg_parser.add_argument('--attr-wrapper', dest='attr_wrapper', choices=('"', "'"), default="'", help="The character that should wrap element attributes. This defaults to ' (an apostrophe).")
+arg_parser.add_argument('--jinja', action='store_true', default=False, help='Makes the necessary changes to be used with Jinja2')
+
+
+class BuildError(Exception):
+    pass
+
+
+class BuildTask(object):
+    '''A template to compile, along with what the manifest knows about it'''
+
+    def __init__(self, source_path, output_path, stat, manifest_hash=None):
+        self.source_path = source_path
+        self.output_path = output_path
+        # Taken before reading the source, so edits made during the build are
+        # picked up by the next one
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.manifest_hash = manifest_hash
+
+
+class BuildResult(object):
+    def __init__(self, task, source_hash=None, compiled=False, error=None):
+        self.task = task
+        self.source_hash = source_hash
+        self.compiled = compiled
+        self.error = error
+
+
+def find_templates(source_dir, output_dir=None, output_ext='.html'):
+    '''Yields (source path, output path) for every template below source_dir'''
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            name, ext = os.path.splitext(filename)
+            # Ignore filenames starting with ".#" for Emacs compatibility
+            if ext.lstrip('.') not in hamlpy.VALID_EXTENSIONS or filename.startswith('.#'):
+                continue
+            source_path = os.path.join(dirpath, filename)
+            if output_dir:
+                target_dir = os.path.normpath(os.path.join(output_dir, os.path.relpath(dirpath, source_dir)))
+            else:
+                target_dir = dirpath
+            yield source_path, os.path.join(target_dir, name + output_ext)
+
+
+def build_template(args):
+    '''Compiles one template unless its output is already up to date'''
+    task, options_dict = args
+    try:
+        haml_source = codecs.open(task.source_path, 'r', encoding='utf-8').read()
+        source_hash = cache_key(haml_source, options_dict)
+        if source_hash == task.manifest_hash and os.path.isfile(task.output_path):
+            return BuildResult(task, source_hash)
+
+        html = hamlpy.Compiler(dict(options_dict)).process(haml_source)
+        atomic_write(task.output_path, html)
+        return BuildResult(task, source_hash, compiled=True)
+    except Exception, e:
+        return BuildResult(task, error='%s: %s' % (e.__class__.__name__, e))
+
+
+def build(source_dirs, output_dir=None, manifest_path=None, options_dict=None,
+          jobs=1, output_ext='.html', verbose=False):
+    '''Compiles all templates below source_dirs and updates the manifest.
+    Returns the list of BuildResults of templates that failed to compile.'''
+    options_dict = options_dict or {}
+    if not manifest_path:
+        manifest_path = os.path.join(output_dir or source_dirs[0], MANIFEST_NAME)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def manifest_relpath(path):
+        return os.path.relpath(os.path.abspath(path), manifest_dir)
+
+    settings = settings_key(options_dict)
+    manifest = load_manifest(manifest_path)
+    if manifest is None or manifest.get('settings') != settings:
+        # Compiler options changed, so no previous output can be trusted
+        manifest = {'sources': {}}
+    previous = manifest['sources']
+
+    templates = []
+    # Source path of every output, to catch templates overwriting each other
+    outputs = {}
+    for source_dir in source_dirs:
+        for source_path, output_path in find_templates(source_dir, output_dir, output_ext):
+            output_key = os.path.normcase(os.path.abspath(output_path))
+            if output_key in outputs:
+                raise BuildError('%s and %s would both be compiled to %s' % (
+                    outputs[output_key], source_path, output_path))
+            outputs[output_key] = source_path
+            templates.append((source_path, output_path))
+
+    sources = {}
+    tasks = []
+    for source_path, output_path in templates:
+        key = manifest_relpath(source_path)
+        entry = previous.get(key)
+        stat = os.stat(source_path)
+        if (entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size
+                and entry['output'] == manifest_relpath(output_path)
+                and os.path.isfile(output_path)):
+            sources[key] = entry
+            continue
+        tasks.append(BuildTask(source_path, output_path, stat, entry and entry['hash']))
+
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs, init_worker,
+                                    (hamlpynodes.TagNode.self_closing, hamlpynodes.TagNode.may_contain))
+        try:
+            results = pool.map(build_template, [(task, options_dict) for task in tasks], chunksize=8)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [build_template((task, options_dict)) for task in tasks]
+
+    failures = []
+    compiled = 0
+    for result in results:
+        task = result.task
+        if result.error:
+            failures.append(result)
+            continue
+        if result.compiled:
+            compiled += 1
+            if verbose:
+                print '%s -> %s' % (task.source_path, task.output_path)
+        sources[manifest_relpath(task.source_path)] = {
+            'hash': result.source_hash,
+            'output': manifest_relpath(task.output_path),
+            'mtime': task.mtime,
+            'size': task.size,
+        }
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'settings': settings,
+        'sources': sources,
+        'artifacts': dict((entry['hash'], entry['output']) for entry in sources.values()),
+    }
+    atomic_write(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+
+    for failure in failures:
+        print >> sys.stderr, "Failed to compile %s -> %s\nReason:\n%s" % (
+            failure.task.source_path, failure.task.output_path, failure.error)
+    print 'Compiled %d, up to date %d, failed %d' % (
+        compiled, len(sources) - compiled, len(failures))
+    return failures
+
+
+def build_templates():
+    '''Main entry point of hamlpy-build'''
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    if getattr(args, 'tags', None):
+        hamlpynodes.TagNode.self_closing.update(args.tags)
+    if args.jinja:
+        hamlpynodes.use_jinja_tags()
+
+    try:
+        failures = build(args.source_dirs, args.output_dir, args.manifest,
+                         {'attr_wrapper': args.attr_wrapper}, max(args.jobs, 1),
+                         args.extension, args.verbose)
+    except BuildError, e:
+        print >> sys.stderr, e
+        sys.exit(1)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    build_templates()
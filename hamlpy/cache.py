@@ -0,0 +1,168 @@
+'''
+Persistent cache of compiled templates, shared between processes.
+
+Compiled HTML is stored under a hash of the HamlPy source and everything else
+that affects the output (compiler options and the Django tag tables), so any
+process compiling the same source with the same options can reuse the result.
+The key also holds a hash of the compiler's own code, so HTML compiled by
+another version of HamlPy is never reused.
+
+A CompileCache keeps the HTML in a backend: any object with get(key),
+returning the HTML stored under key or None, and set(key, html).
+'''
+import codecs
+import hashlib
+import os
+
+import attributes
+import elements
+import hamlpy
+import lexer
+import nodes
+from utils import atomic_write
+
+
+def _source_path(module):
+    path = module.__file__
+    if path.endswith(('.pyc', '.pyo')) and os.path.exists(path[:-1]):
+        return path[:-1]
+    return path
+
+
+def _compiler_digest():
+    '''Hashes the code of the modules that decide the HTML of a template'''
+    digest = hashlib.sha1()
+    for module in (hamlpy, lexer, nodes, elements, attributes):
+        with open(_source_path(module), 'rb') as module_file:
+            digest.update(module_file.read())
+    return digest.hexdigest()
+
+# Changes whenever the compiler does
+COMPILER_DIGEST = _compiler_digest()
+
+
+# Compiler options that are used when they are not given explicitly
+DEFAULT_OPTIONS = {'attr_wrapper': "'"}
+
+
+def settings_key(options_dict=None, splitlines=False):
+    '''Describes everything besides the source that affects compiled HTML'''
+    options = dict(DEFAULT_OPTIONS)
+    options.update(options_dict or {})
+    options.pop('debug_tree', None)
+    return repr((
+        COMPILER_DIGEST,
+        splitlines,
+        sorted((k, unicode(v)) for k, v in options.items()),
+        sorted(nodes.TagNode.self_closing.items()),
+        sorted(nodes.TagNode.may_contain.items()),
+    ))
+
+
+def cache_key(source, options_dict=None, splitlines=False):
+    '''Returns the content address of source compiled with options_dict'''
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+
+    digest = hashlib.sha1(settings_key(options_dict, splitlines))
+    digest.update('\0')
+    digest.update(source)
+    return digest.hexdigest()
+
+
+class FileSystemBackend(object):
+    '''Stores each compiled template in its own file below directory'''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + '.html')
+
+    def get(self, key):
+        try:
+            with codecs.open(self.path(key), 'r', encoding='utf-8') as cached:
+                return cached.read()
+        except (IOError, OSError, UnicodeDecodeError):
+            return None
+
+    def set(self, key, html):
+        atomic_write(self.path(key), html)
+
+
+class DjangoCacheBackend(object):
+    '''Stores compiled templates in one of the caches configured in Django'''
+
+    def __init__(self, alias='default', timeout=None, key_prefix='hamlpy:'):
+        try:
+            from django.core.cache import caches
+            self.cache = caches[alias]
+        except ImportError:
+            # Django < 1.7
+            from django.core.cache import get_cache
+            self.cache = get_cache(alias)
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        return self.cache.get(self.key_prefix + key)
+
+    def set(self, key, html):
+        self.cache.set(self.key_prefix + key, html, self.timeout)
+
+
+class CompileCache(object):
+    '''Compiles HamlPy source, reusing HTML already compiled by any process
+    sharing the same backend'''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, source, options_dict=None, splitlines=False, compile=None):
+        '''Returns source compiled to HTML. By default source is split on
+        newlines like Compiler.process does; pass splitlines=True to split it
+        with str.splitlines like the command line tools do. compile, if given,
+        is called with source on a miss to get the HTML instead, and must
+        compile it with the same options.'''
+        key = cache_key(source, options_dict, splitlines)
+        html = self.backend.get(key)
+        if html is not None:
+            self.hits += 1
+            return html
+
+        self.misses += 1
+        if compile is not None:
+            html = compile(source)
+        elif splitlines:
+            html = hamlpy.Compiler(dict(options_dict or {})).process_lines(source.splitlines())
+        else:
+            html = hamlpy.Compiler(dict(options_dict or {})).process(source)
+        self.backend.set(key, html)
+        return html
+
+
+def get_settings_cache():
+    '''Returns the CompileCache configured in the Django settings, if any.
+
+    HAMLPY_CACHE_DIR selects a directory to keep compiled templates in, and
+    HAMLPY_DJANGO_CACHE the alias of a Django cache to use instead.
+    '''
+    try:
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+    except ImportError:
+        return None
+
+    try:
+        cache_dir = getattr(settings, 'HAMLPY_CACHE_DIR', None)
+        django_cache = getattr(settings, 'HAMLPY_DJANGO_CACHE', None)
+    except ImproperlyConfigured:
+        return None
+
+    if cache_dir:
+        return CompileCache(FileSystemBackend(cache_dir))
+    if django_cache:
+        return CompileCache(DjangoCacheBackend(django_cache))
+    return None
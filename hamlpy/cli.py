@@ -0,0 +1,25 @@
+'''
+Helpers shared by the hamlpy-watcher and hamlpy-build command line tools.
+'''
+import argparse
+
+import nodes as hamlpynodes
+
+
+class StoreNameValueTagPair(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string = None):
+        tags = getattr(namespace, 'tags', {})
+        if tags is None:
+            tags = {}
+        for item in values:
+            n, v = item.split(':')
+            tags[n] = v
+
+        setattr(namespace, 'tags', tags)
+
+
+def init_worker(self_closing, may_contain):
+    '''Sets the tag tables of a worker process compiling templates'''
+    # Workers may not inherit the tag tables when processes are spawned
+    hamlpynodes.TagNode.self_closing = self_closing
+    hamlpynodes.TagNode.may_contain = may_contain
@@ -0,0 +1,60 @@
+'''
+Index of which templates extend or include which, used by hamlpy-watcher to
+tell which templates are affected by a change.
+
+Templates are identified by their path relative to the watched folder without
+extension, so "- extends 'base.html'" and "- include 'base.hamlpy'" both
+refer to base.hamlpy.
+'''
+import os
+
+
+def template_key(name):
+    '''Identifies a template by its name or relative path'''
+    return os.path.splitext(os.path.normpath(name))[0].replace(os.sep, '/')
+
+
+class DependencyIndex(object):
+    '''Keeps track of the templates each template depends on, and of the
+    templates depending on each template'''
+
+    def __init__(self):
+        # template key -> keys of the templates it extends or includes
+        self.dependencies = {}
+        # template key -> keys of the templates extending or including it
+        self.dependents = {}
+
+    def update(self, name, dependencies):
+        '''Records the templates the template called name now depends on'''
+        key = template_key(name)
+        self._unlink(key)
+        keys = set(template_key(dependency) for dependency in dependencies)
+        self.dependencies[key] = keys
+        for dependency in keys:
+            self.dependents.setdefault(dependency, set()).add(key)
+
+    def remove(self, name):
+        '''Forgets the dependencies of a removed template. Templates depending
+        on it keep referring to it.'''
+        self._unlink(template_key(name))
+        self.dependencies.pop(template_key(name), None)
+
+    def affected(self, name):
+        '''Returns the keys of all templates that directly or indirectly extend
+        or include the template called name'''
+        affected = set()
+        pending = [template_key(name)]
+        while pending:
+            for dependent in self.dependents.get(pending.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    pending.append(dependent)
+        return affected
+
+    def _unlink(self, key):
+        for dependency in self.dependencies.get(key, ()):
+            dependents = self.dependents.get(dependency)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    del self.dependents[dependency]
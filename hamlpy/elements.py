@@ -1,9 +1,42 @@
 import re
 import sys
-from types import NoneType
+
+from attributes import closing_brace, parse_attribute_dict
+
+# Maximum number of parsed elements kept by parse_element
+ELEMENT_CACHE_SIZE = 4096
+
+# (haml, attr_wrapper) -> Element, shared by all compilers
+_element_cache = {}
+# The self closing tags the cached elements were parsed with
+_element_cache_tags = None
+
+
+def parse_element(haml, attr_wrapper="'"):
+    '''Returns the Element for haml, reusing the one parsed earlier for the
+    same header and attr_wrapper. Elements returned are shared, so they must
+    not be changed.'''
+    global _element_cache_tags
+    if _element_cache_tags is not Element.self_closing_tags:
+        # Cached elements may be self closing or not by the old tags
+        _element_cache.clear()
+        _element_cache_tags = Element.self_closing_tags
+    key = (haml, attr_wrapper)
+    element = _element_cache.get(key)
+    if element is None:
+        element = Element(haml, attr_wrapper)
+        if len(_element_cache) >= ELEMENT_CACHE_SIZE:
+            # Cheaper than tracking use; headers that keep recurring come back
+            _element_cache.clear()
+        _element_cache[key] = element
+    return element
+
 
 class Element(object):
     """contains the pieces of an element and can populate itself from haml element text"""
+    __slots__ = ('haml', 'attr_wrapper', 'tag', 'id', 'classes', 'attributes', 'attributes_dict',
+                 'self_close', 'django_variable', 'nuke_inner_whitespace', 'nuke_outer_whitespace',
+                 'inline_content')
 
     self_closing_tags = ('meta', 'img', 'link', 'br', 'hr', 'input', 'source', 'track')
 
@@ -11,26 +44,25 @@ class Element(object):
     ID = '#'
     CLASS = '.'
 
-    HAML_REGEX = re.compile(r"""
-    (?P<tag>%\w+(\:\w+)?)?
-    (?P<id>\#[\w-]*)?
-    (?P<class>\.[\w\.-]*)*
-    (?P<attributes>\{.*\})?
-    (?P<nuke_outer_whitespace>\>)?
-    (?P<nuke_inner_whitespace>\<)?
-    (?P<selfclose>/)?
-    (?P<django>=)?
-    (?P<inline>[^\w\.#\{].*)?
-    """, re.X | re.MULTILINE | re.DOTALL | re.UNICODE)
-
-    _ATTRIBUTE_KEY_REGEX = r'(?P<key>[a-zA-Z_][a-zA-Z0-9_-]*)'
-    #Single and double quote regexes from: http://stackoverflow.com/a/5453821/281469
-    _SINGLE_QUOTE_STRING_LITERAL_REGEX = r"'([^'\\]*(?:\\.[^'\\]*)*)'"
-    _DOUBLE_QUOTE_STRING_LITERAL_REGEX = r'"([^"\\]*(?:\\.[^"\\]*)*)"'
-    _ATTRIBUTE_VALUE_REGEX = r'(?P<val>\d+|None(?!\w)|%s|%s)' % (_SINGLE_QUOTE_STRING_LITERAL_REGEX, _DOUBLE_QUOTE_STRING_LITERAL_REGEX)
-
-    RUBY_HAML_REGEX = re.compile(r'(:|\")%s(\"|) =>' % (_ATTRIBUTE_KEY_REGEX))
-    ATTRIBUTE_REGEX = re.compile(r'(?P<pre>\{\s*|,\s*)%s\s*:\s*%s' % (_ATTRIBUTE_KEY_REGEX, _ATTRIBUTE_VALUE_REGEX), re.UNICODE)
+    # The parts of an element before and after its attributes, see split_haml.
+    # Neither can backtrack: every part is optional and stops at the first
+    # character that can't continue it.
+    HEAD_REGEX = re.compile(r"""
+    (%\w+(?::\w+)?)?          # tag
+    (\#[\w-]*)?               # id
+    (\.[\w.-]*)?              # classes
+    (\{)?                     # start of attributes
+    """, re.X | re.UNICODE)
+    TAIL_REGEX = re.compile(r"""
+    (\>)?                     # nuke outer whitespace
+    (\<)?                     # nuke inner whitespace
+    (/)?                      # self close
+    (=)?                      # django variable
+    ([^\w\.#\{].*)?           # inline content
+    """, re.X | re.DOTALL | re.UNICODE)
+
+    # A Django tag, which may be left open at the end of the value
+    DJANGO_TAG_REGEX = re.compile(r'\{(?:%\}|%.*?%\}|%.*\Z)', re.DOTALL)
     DJANGO_VARIABLE_REGEX = re.compile(r'^\s*=\s(?P<variable>[a-zA-Z_][a-zA-Z0-9._-]*)\s*$')
 
 
@@ -51,8 +83,50 @@ class Element(object):
     def attr_wrap(self, value):
         return '%s%s%s' % (self.attr_wrapper, value, self.attr_wrapper)
 
+    @classmethod
+    def split_haml(cls, haml):
+        '''Splits element text into its parts, which are empty when missing:
+
+            %tag:ns#id.class.class{attributes}><=/inline content
+
+        Attributes run from an opening brace right after the classes to the
+        brace closing it, skipping braces in strings, so inline content can
+        hold braces of its own. Takes linear time however long the attributes
+        or content are.'''
+        head = cls.HEAD_REGEX.match(haml)
+        tag, id, classes, brace = head.groups('')
+        pos = head.end()
+
+        attributes = ''
+        if brace:
+            closing = closing_brace(haml, pos - 1)
+            if closing == -1:
+                # Not attributes after all
+                pos -= 1
+            elif haml.startswith('{', closing + 1):
+                # A second dictionary, kept so the attributes fail to parse
+                attributes = haml[pos - 1:]
+                pos = len(haml)
+            else:
+                attributes = haml[pos - 1:closing + 1]
+                pos = closing + 1
+
+        nuke_outer_whitespace, nuke_inner_whitespace, selfclose, django, inline = \
+            cls.TAIL_REGEX.match(haml, pos).groups('')
+        return {
+            'tag': tag,
+            'id': id,
+            'class': classes,
+            'attributes': attributes,
+            'nuke_outer_whitespace': nuke_outer_whitespace,
+            'nuke_inner_whitespace': nuke_inner_whitespace,
+            'selfclose': selfclose,
+            'django': django,
+            'inline': inline,
+        }
+
     def _parse_haml(self):
-        split_tags = self.HAML_REGEX.search(self.haml).groupdict('')
+        split_tags = self.split_haml(self.haml)
 
         self.attributes_dict = self._parse_attribute_dictionary(split_tags.get('attributes'))
         self.tag = split_tags.get('tag').strip(self.ELEMENT) or 'div'
@@ -66,7 +140,7 @@ class Element(object):
 
     def _parse_class_from_attributes_dict(self):
         clazz = self.attributes_dict.get('class', '')
-        if not isinstance(clazz, str):
+        if not isinstance(clazz, basestring):
             clazz = ''
             for one_class in self.attributes_dict.get('class'):
                 clazz += ' ' + one_class
@@ -82,7 +156,7 @@ class Element(object):
     def _parse_id_dict(self, id_dict):
         text = ''
         id_dict = self.attributes_dict.get('id')
-        if isinstance(id_dict, str):
+        if isinstance(id_dict, basestring):
             text = '_' + id_dict
         else:
             text = ''
@@ -94,58 +168,47 @@ class Element(object):
         '''
         Escapes quotes with a backslash, except those inside a Django tag
         '''
+        quote = self.attr_wrapper
+        if quote not in v:
+            return v
         escaped = []
-        inside_tag = False
-        for i, _ in enumerate(v):
-            if v[i:i + 2] == '{%':
-                inside_tag = True
-            elif v[i:i + 2] == '%}':
-                inside_tag = False
-
-            if v[i] == self.attr_wrapper and not inside_tag:
-                escaped.append('\\')
-
-            escaped.append(v[i])
-
+        start = 0
+        for tag in self.DJANGO_TAG_REGEX.finditer(v):
+            escaped.append(v[start:tag.start()].replace(quote, '\\' + quote))
+            escaped.append(tag.group())
+            start = tag.end()
+        escaped.append(v[start:].replace(quote, '\\' + quote))
         return ''.join(escaped)
 
     def _parse_attribute_dictionary(self, attribute_dict_string):
         attributes_dict = {}
         if (attribute_dict_string):
-            attribute_dict_string = attribute_dict_string.replace('\n', ' ')
             try:
-                # converting all allowed attributes to python dictionary style
-
-                # Replace Ruby-style HAML with Python style
-                attribute_dict_string = re.sub(self.RUBY_HAML_REGEX, '"\g<key>":', attribute_dict_string)
-                # Put double quotes around key
-                attribute_dict_string = re.sub(self.ATTRIBUTE_REGEX, '\g<pre>"\g<key>":\g<val>', attribute_dict_string)
-                # Parse string as dictionary
-                attributes_dict = eval(attribute_dict_string)
-                for k, v in attributes_dict.items():
-                    if k != 'id' and k != 'class':
-                        if isinstance(v, NoneType):
-                            self.attributes += "%s " % (k,)
-                        elif isinstance(v, int) or isinstance(v, float):
-                            self.attributes += "%s=%s " % (k, self.attr_wrap(v))
-                        else:
-                            # DEPRECATED: Replace variable in attributes (e.g. "= somevar") with Django version ("{{somevar}}")
-                            v = re.sub(self.DJANGO_VARIABLE_REGEX, '{{\g<variable>}}', attributes_dict[k])
-                            if v != attributes_dict[k]:
-                                sys.stderr.write("\n---------------------\nDEPRECATION WARNING: %s" % self.haml.lstrip() + \
-                                                 "\nThe Django attribute variable feature is deprecated and may be removed in future versions." +
-                                                 "\nPlease use inline variables ={...} instead.\n-------------------\n")
-
-                            attributes_dict[k] = v
-                            v = v.decode('utf-8')
-                            self.attributes += "%s=%s " % (k, self.attr_wrap(self._escape_attribute_quotes(v)))
-                self.attributes = self.attributes.strip()
-            except Exception, e:
-                raise Exception('failed to decode: %s' % attribute_dict_string)
-                #raise Exception('failed to decode: %s. Details: %s'%(attribute_dict_string, e))
+                attributes_dict = parse_attribute_dict(attribute_dict_string)
+            except ValueError, e:
+                raise Exception('failed to decode: %s' % attribute_dict_string.replace('\n', ' '))
+
+            attributes = []
+            for k, v in attributes_dict.items():
+                if k == 'id' or k == 'class':
+                    continue
+                if v is None:
+                    attributes.append(k)
+                elif isinstance(v, (int, float)):
+                    attributes.append("%s=%s" % (k, self.attr_wrap(v)))
+                elif isinstance(v, basestring):
+                    if '=' in v:
+                        # DEPRECATED: Replace variable in attributes (e.g. "= somevar") with Django version ("{{somevar}}")
+                        django_variable = self.DJANGO_VARIABLE_REGEX.sub('{{\g<variable>}}', v)
+                        if django_variable != v:
+                            sys.stderr.write("\n---------------------\nDEPRECATION WARNING: %s" % self.haml.lstrip() + \
+                                             "\nThe Django attribute variable feature is deprecated and may be removed in future versions." +
+                                             "\nPlease use inline variables ={...} instead.\n-------------------\n")
+                            attributes_dict[k] = v = django_variable
+                    attributes.append("%s=%s" % (k, self.attr_wrap(self._escape_attribute_quotes(v))))
+                else:
+                    raise Exception('failed to decode: %s' % attribute_dict_string.replace('\n', ' '))
+            if attributes:
+                self.attributes = ('%s %s' % (self.attributes, ' '.join(attributes))).strip()
 
         return attributes_dict
-
-
-
-
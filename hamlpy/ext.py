@@ -6,6 +6,7 @@ except ImportError, e:
     _jinja2_available = False
 
 import hamlpy
+import metrics
 import os
 
 HAML_FILE_NAME_EXTENSIONS = ['haml', 'hamlpy']
@@ -31,12 +32,29 @@ def has_any_extension(file_path, extensions):
 if _jinja2_available:
     class HamlPyExtension(jinja2.ext.Extension):
 
+        def __init__(self, environment):
+            super(HamlPyExtension, self).__init__(environment)
+            # Set to a hamlpy.cache.CompileCache to share compiled templates
+            # between processes
+            environment.extend(hamlpy_cache=None)
+
         def preprocess(self, source, name, filename=None):
             if name and has_any_extension(name, HAML_FILE_NAME_EXTENSIONS):
-                compiler = hamlpy.Compiler()
                 try:
-                    return compiler.process(source)
+                    return self._compile(source)
                 except Exception as e:
                     raise jinja2.TemplateSyntaxError(e, 1, name=name, filename=filename)
             else:
                 return source
+
+        def _compile(self, source):
+            if self.environment.hamlpy_cache is not None:
+                return self.environment.hamlpy_cache.compile(source, compile=self._timed_process)
+            return self._timed_process(source)
+
+        def _timed_process(self, source):
+            return metrics.timed_compile('jinja2', self._process, source)
+
+        def _process(self, source):
+            compiler = hamlpy.Compiler()
+            return compiler.process(source)
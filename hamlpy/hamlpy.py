@@ -1,52 +1,137 @@
 #!/usr/bin/env python
-from nodes import RootNode, FilterNode, HamlNode, create_node
+from lexer import tokenize
+from nodes import RootNode, TreeCursor, TagNode, TAG
+from profiling import CompileStats
 from optparse import OptionParser
 import sys
+import time
 
 VALID_EXTENSIONS=['haml', 'hamlpy']
 
 class Compiler:
 
-    def __init__(self, options_dict=None):
+    def __init__(self, options_dict=None, on_stats=None):
         options_dict = options_dict or {}
         self.debug_tree = options_dict.pop('debug_tree', False)
         self.options_dict = options_dict
+        # Templates extended or included by the last template processed
+        self.dependencies = []
+        # Called with the profiling.CompileStats of every template processed
+        self.on_stats = on_stats
 
     def process(self, raw_text):
         split_text = raw_text.split('\n')
         return self.process_lines(split_text)
 
     def process_lines(self, haml_lines):
-        root = RootNode(**self.options_dict)
-        line_iter = iter(haml_lines)
-
-        haml_node=None
-        for line_number, line in enumerate(line_iter):
-            node_lines = line
+        if self.on_stats is not None:
+            return self._process_with_stats(haml_lines)
 
-            if not root.parent_of(HamlNode(line)).inside_filter_node():
-                if line.count('{') - line.count('}') == 1:
-                    start_multiline=line_number # For exception handling
+        root = self._build_tree(tokenize(haml_lines))
+        if self.options_dict and self.options_dict.get('debug_tree'):
+            return root.debug_tree()
+        else:
+            return root.render()
 
-                    while line.count('{') - line.count('}') != -1:
-                        try:
-                            line = line_iter.next()
-                        except StopIteration:
-                            raise Exception('No closing brace found for multi-line HAML beginning at line %s' % (start_multiline+1))
-                        node_lines += line
+    def _process_with_stats(self, haml_lines):
+        stats = CompileStats()
+        start = time.time()
+        tokens = list(tokenize(haml_lines))
+        tokenized = time.time()
+        root = self._build_tree(tokens, stats.lines)
+        built = time.time()
+        html = root.render(stats.render_node)
+        rendered = time.time()
+
+        stats.add_phase('tokenize', tokenized - start)
+        stats.add_phase('build', built - tokenized)
+        nodes_time = sum(stats.node_times.values())
+        stats.add_phase('nodes', nodes_time)
+        stats.add_phase('generate', rendered - built - nodes_time)
+        stats.count_nodes()
+        stats.finish()
+        self.on_stats(stats)
+        return html
+
+    def _build_tree(self, tokens, lines=None):
+        '''Returns the tree of the given tokens. lines, if given, is filled
+        with the line number of every node.'''
+        root = RootNode(**self.options_dict)
+        cursor = TreeCursor(root)
+        self.dependencies = []
 
+        haml_node=None
+        for token in tokens:
             # Blank lines
-            if haml_node is not None and len(node_lines.strip()) == 0:
-                haml_node.newlines += 1
+            if token.kind is None:
+                if haml_node is not None:
+                    haml_node.newlines += 1
             else:
-                haml_node = create_node(node_lines)
-                if haml_node:
-                    root.add_node(haml_node)
+                haml_node = token.node()
+                cursor.add_node(haml_node)
+                if lines is not None:
+                    lines[haml_node] = token.start
+                if isinstance(haml_node, TagNode) and haml_node.dependency():
+                    self.dependencies.append(haml_node.dependency())
+        return root
+
+    def stream(self, haml_lines):
+        '''Yields the HTML of the given lines a top-level node at a time, as
+        soon as the next one is read. The lines can come from any iterable,
+        such as a file, and only the node being read is kept in memory.'''
+        root = RootNode(**self.options_dict)
+        cursor = TreeCursor(root)
+        self.dependencies = []
 
-        if self.options_dict and self.options_dict.get('debug_tree'):
-            return root.debug_tree()
-        else:
-            return root.render()
+        haml_node=None
+        # The last top-level node, and the one before it
+        pending = None
+        left_sibling = None
+        for token in tokenize(line.rstrip('\r\n') for line in haml_lines):
+            # Blank lines
+            if token.kind is None:
+                if haml_node is not None:
+                    haml_node.newlines += 1
+                continue
+
+            haml_node = token.node()
+            cursor.add_node(haml_node)
+            if isinstance(haml_node, TagNode) and haml_node.dependency():
+                self.dependencies.append(haml_node.dependency())
+
+            if haml_node.parent is root:
+                # Nothing more can go inside the previous top-level node
+                if pending is not None:
+                    yield root.render_subtree(pending, left_sibling, haml_node)
+                    # Only whether it removes whitespace matters from now on
+                    del pending.children[:]
+                    del root.children[0]
+                    left_sibling = pending
+                pending = haml_node
+
+        if pending is not None:
+            yield root.render_subtree(pending, left_sibling)
+
+    def stream_to(self, haml_lines, output):
+        '''Writes the HTML of the given lines to the file-like object output
+        as it is rendered, see stream'''
+        for chunk in self.stream(haml_lines):
+            output.write(chunk)
+
+def find_dependencies(haml_lines):
+    '''Returns the templates extended or included by the given lines, like
+    Compiler.dependencies, without compiling them'''
+    dependencies = []
+    for line in haml_lines:
+        stripped_line = line.strip()
+        if stripped_line.startswith(TAG) and not stripped_line.startswith('-#'):
+            try:
+                dependency = TagNode(line).dependency()
+            except TypeError:
+                continue
+            if dependency:
+                dependencies.append(dependency)
+    return dependencies
 
 def convert_files():
     import sys
@@ -63,20 +148,43 @@ def convert_files():
         action="store",
         help="The character that should wrap element attributes. "
         "This defaults to ' (an apostrophe).")
+    parser.add_option(
+        "--cache-dir", dest="cache_dir",
+        action="store",
+        help="Directory to keep compiled templates in, shared with "
+        "other HamlPy processes")
+    parser.add_option(
+        "--stats", dest="stats",
+        action="store_true",
+        help="Print where the time of the compile went to stderr")
     (options, args) = parser.parse_args()
 
     if len(args) < 1:
         print "Specify the input file as the first argument."
     else:
         infile = args[0]
-        haml_lines = codecs.open(infile, 'r', encoding='utf-8').read().splitlines()
-
-        compiler = Compiler(options.__dict__)
-        output = compiler.process_lines(haml_lines)
+        haml_source = codecs.open(infile, 'r', encoding='utf-8').read()
+
+        compiler_args = options.__dict__
+        cache_dir = compiler_args.pop('cache_dir')
+        show_stats = compiler_args.pop('stats')
+        if cache_dir and not options.debug_tree and not show_stats:
+            from cache import CompileCache, FileSystemBackend
+            compile_cache = CompileCache(FileSystemBackend(cache_dir))
+            output = compile_cache.compile(haml_source, compiler_args, splitlines=True)
+        else:
+            on_stats = None
+            if show_stats:
+                on_stats = lambda stats: sys.stderr.write(stats.report())
+            compiler = Compiler(compiler_args, on_stats=on_stats)
+            output = compiler.process_lines(haml_source.splitlines())
 
         if len(args) == 2:
-            outfile = codecs.open(args[1], 'w', encoding='utf-8')
-            outfile.write(output)
+            from utils import write_if_changed
+            if write_if_changed(args[1], output):
+                print "Wrote %s" % args[1]
+            else:
+                print "%s is unchanged" % args[1]
         else:
             print output
 
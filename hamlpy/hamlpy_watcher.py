@@ -3,15 +3,25 @@
 #
 # Watch a folder for files with the given extensions and call the HamlPy
 # compiler if the modified time has changed since the last check.
+# On Linux, changes are picked up through inotify as soon as they happen;
+# elsewhere the folder is scanned every few seconds.
 from time import strftime
 import argparse
 import sys
 import codecs
+import hashlib
+import json
+import multiprocessing
 import os
 import os.path
 import time
 import hamlpy
+import inotify
 import nodes as hamlpynodes
+from cache import CompileCache, FileSystemBackend, settings_key
+from cli import StoreNameValueTagPair, init_worker
+from dependencies import DependencyIndex
+from utils import atomic_write, write_if_changed
 
 try:
     str = unicode
@@ -23,20 +33,19 @@ class Options(object):
     DEBUG = False  # print file paths when a file is compiled
     VERBOSE = False
     OUTPUT_EXT = '.html'
+    CACHE = None  # CompileCache shared with other processes, if any
+    STATE_FILE = '.hamlpy-watcher-state.json'  # kept in the output folder
+    JOBS = 1  # number of processes compiling files when many changed at once
 
-# dict of compiled files [fullpath : timestamp]
+# dict of compiled files [fullpath : {mtime, size, hash, dependencies}]
 compiled = dict()
 
-class StoreNameValueTagPair(argparse.Action):
-    def __call__(self, parser, namespace, values, option_string = None):
-        tags = getattr(namespace, 'tags', {})
-        if tags is None:
-            tags = {}
-        for item in values:
-            n, v = item.split(':')
-            tags[n] = v
-        
-        setattr(namespace, 'tags', tags)
+# templates extended or included by the compiled files, by path relative to
+# the watched folder
+dependency_index = DependencyIndex()
+
+# worker processes, started on the first batch of changes that needs them
+_pool = None
 
 arg_parser = argparse.ArgumentParser()
 arg_parser.add_argument('-v', '--verbose', help = 'Display verbose output', action = 'store_true')
@@ -48,6 +57,9 @@ arg_parser.add_argument('output_dir', help = 'Destination folder', type = str, n
 arg_parser.add_argument('--tag', help = 'Add self closing tag. eg. --tag macro:endmacro', type = str, nargs = 1, action = StoreNameValueTagPair)
 arg_parser.add_argument('--attr-wrapper', dest = 'attr_wrapper', type = str, choices = ('"', "'"), default = "'", action = 'store', help = "The character that should wrap element attributes. This defaults to ' (an apostrophe).")
 arg_parser.add_argument('--jinja', help = 'Makes the necessary changes to be used with Jinja2', default = False, action = 'store_true')
+arg_parser.add_argument('--poll', help = 'Scan the folder for changes every --refresh seconds instead of using inotify', default = False, action = 'store_true')
+arg_parser.add_argument('-j', '--jobs', metavar = 'N', default = Options.JOBS, help = 'Number of files to compile in parallel when many change at once. Default is {}'.format(Options.JOBS), type = int)
+arg_parser.add_argument('--cache-dir', dest = 'cache_dir', metavar = 'DIR', help = 'Directory to keep compiled templates in, shared with other HamlPy processes', type = str)
 
 def watched_extension(extension):
     """Return True if the given extension is one of the watched extensions"""
@@ -85,70 +97,298 @@ def watch_folder():
         compiler_args['attr_wrapper'] = args.attr_wrapper
     
     if args.jinja:
-        for k in ('ifchanged', 'ifequal', 'ifnotequal', 'autoescape', 'blocktrans',
-                  'spaceless', 'comment', 'cache', 'localize', 'compress'):
-            del hamlpynodes.TagNode.self_closing[k]
-            
-            hamlpynodes.TagNode.may_contain.pop(k, None)
-        
-        hamlpynodes.TagNode.self_closing.update({
-            'macro'  : 'endmacro',
-            'call'   : 'endcall',
-            'raw'    : 'endraw'
-        })
-        
-        hamlpynodes.TagNode.may_contain['for'] = 'else'
-    
-    while True:
-        try:
+        hamlpynodes.use_jinja_tags()
+    
+    if args.cache_dir:
+        Options.CACHE = CompileCache(FileSystemBackend(args.cache_dir))
+    
+    if args.jobs:
+        Options.JOBS = max(args.jobs, 1)
+    
+    _load_state(input_folder, output_folder, compiler_args)
+    
+    try:
+        if not args.poll:
+            # Only returns if inotify is unavailable
+            _watch_events(input_folder, output_folder, compiler_args)
+        while True:
             _watch_folder(input_folder, output_folder, compiler_args)
             time.sleep(args.refresh)
-        except KeyboardInterrupt:
-            # allow graceful exit (no stacktrace output)
-            sys.exit(0)
+    except KeyboardInterrupt:
+        # allow graceful exit (no stacktrace output)
+        _close_pool(terminate = True)
+        sys.exit(0)
+
+def _watch_events(folder, destination, compiler_args):
+    """Compiles files as soon as inotify reports a change. Returns right away
+    if inotify is not available, or as soon as the folder can no longer be
+    watched as a whole."""
+    try:
+        watcher = inotify.Inotify()
+    except inotify.InotifyUnavailable, e:
+        if Options.VERBOSE:
+            print "Falling back to polling: %s" % e
+        return
+    
+    try:
+        watcher.add_tree(folder)
+        # Files changed before the watch started are caught by a full scan
+        _watch_folder(folder, destination, compiler_args)
+        while True:
+            changed = watcher.wait()
+            if watcher.overflowed:
+                # Events were lost
+                watcher.overflowed = False
+                _watch_folder(folder, destination, compiler_args)
+            else:
+                _compile_changed(changed, folder, destination, compiler_args)
+    except inotify.InotifyUnavailable, e:
+        # Out of watches, at the start or for a folder created later
+        print "Falling back to polling: %s" % e
+    finally:
+        watcher.close()
 
 def _watch_folder(folder, destination, compiler_args):
     """Compares "modified" timestamps against the "compiled" dict, calls compiler
     if necessary."""
+    found = []
     for dirpath, dirnames, filenames in os.walk(folder):
         for filename in filenames:
             # Ignore filenames starting with ".#" for Emacs compatibility
             if watched_extension(filename) and not filename.startswith('.#'):
-                fullpath = os.path.join(dirpath, filename)
-                subfolder = os.path.relpath(dirpath, folder)
-                mtime = os.stat(fullpath).st_mtime
-                
-                # Create subfolders in target directory if they don't exist
-                compiled_folder = os.path.join(destination, subfolder)
-                if not os.path.exists(compiled_folder):
-                    os.makedirs(compiled_folder)
-                
-                compiled_path = _compiled_path(compiled_folder, filename)
-                if (not fullpath in compiled or
-                    compiled[fullpath] < mtime or
-                    not os.path.isfile(compiled_path)):
-                    compile_file(fullpath, compiled_path, compiler_args)
-                    compiled[fullpath] = mtime
+                found.append(os.path.join(dirpath, filename))
+    
+    changed = _compile_batch(sorted(found), folder, destination, compiler_args)
+    found = set(found)
+    for fullpath in [s for s in compiled if s not in found]:
+        changed |= _source_removed(fullpath, folder, destination)
+    
+    if changed:
+        _save_state(folder, destination, compiler_args)
 
-def _compiled_path(destination, filename):
-    return os.path.join(destination, filename[:filename.rfind('.')] + Options.OUTPUT_EXT)
+def _compile_changed(paths, folder, destination, compiler_args):
+    """Handles the paths reported changed by inotify"""
+    changed = False
+    sources = []
+    for fullpath in sorted(paths):
+        filename = os.path.basename(fullpath)
+        if os.path.isfile(fullpath):
+            if watched_extension(filename) and not filename.startswith('.#'):
+                sources.append(fullpath)
+        elif not os.path.exists(fullpath):
+            # Deleted or moved away, possibly with a whole folder
+            prefix = fullpath + os.sep
+            for source in [s for s in compiled if s == fullpath or s.startswith(prefix)]:
+                changed |= _source_removed(source, folder, destination)
+    
+    changed |= _compile_batch(sources, folder, destination, compiler_args)
+    if changed:
+        _save_state(folder, destination, compiler_args)
+
+def _compile_batch(paths, folder, destination, compiler_args):
+    """Compiles those of the given files whose content changed since they were
+    last compiled, in parallel when there are several of them and more than one
+    job was requested. Failures are reported once the whole batch is done.
+    Returns True if the "compiled" dict changed."""
+    changed = False
+    jobs = []
+    for fullpath in paths:
+        job = _compile_job_for(fullpath, folder, destination)
+        if isinstance(job, CompileJob):
+            jobs.append(job)
+        else:
+            changed |= job
+    
+    if Options.JOBS > 1 and len(jobs) > 1:
+        pending = [job for job in jobs if job.error is None]
+        # map_async lets KeyboardInterrupt through, unlike map
+        results = _get_pool().map_async(
+            _compile_in_worker, [(job.fullpath, job.compiled_path, compiler_args, job.haml_source) for job in pending],
+            chunksize = 1).get(60 * 60 * 24)
+        for job, (dependencies, written, error) in zip(pending, results):
+            job.dependencies, job.written, job.error = dependencies, written, error
+    else:
+        for job in jobs:
+            if job.error is None:
+                job.dependencies, job.written, job.error = _compile_in_worker((job.fullpath, job.compiled_path, compiler_args, job.haml_source))
+    
+    for job in jobs:
+        _record(job, folder)
+    for job in jobs:
+        if job.error is not None:
+            print "Failed to compile %s -> %s\nReason:\n%s" % (job.fullpath, job.compiled_path, job.error)
+    if jobs and Options.VERBOSE:
+        written = len([job for job in jobs if job.written])
+        failed = len([job for job in jobs if job.error is not None])
+        print '%s wrote %d, unchanged %d, failed %d' % (strftime("%H:%M:%S"), written, len(jobs) - written - failed, failed)
+    return changed or bool(jobs)
 
-def compile_file(fullpath, outfile_name, compiler_args):
-    """Calls HamlPy compiler."""
+class CompileJob(object):
+    """A changed file to compile, along with its state when it was read"""
+    def __init__(self, fullpath, compiled_path, stat, content_hash, haml_source = None, error = None):
+        self.fullpath = fullpath
+        self.compiled_path = compiled_path
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.content_hash = content_hash
+        self.haml_source = haml_source
+        self.dependencies = None
+        self.written = False  # False when the output already had the compiled HTML
+        self.error = error
+
+def _compile_job_for(fullpath, folder, destination):
+    """Returns a CompileJob if fullpath needs to be compiled, otherwise True if
+    the "compiled" dict changed and False if it didn't"""
+    subfolder = os.path.relpath(os.path.dirname(fullpath), folder)
+    try:
+        stat = os.stat(fullpath)
+    except OSError:
+        # Removed in the meantime
+        return False
+    
+    # Create subfolders in target directory if they don't exist
+    compiled_folder = os.path.join(destination, subfolder)
+    if not os.path.exists(compiled_folder):
+        os.makedirs(compiled_folder)
+    
+    compiled_path = _compiled_path(compiled_folder, os.path.basename(fullpath))
+    state = compiled.get(fullpath)
+    output_exists = os.path.isfile(compiled_path)
+    if (state and output_exists and
+        state['mtime'] == stat.st_mtime and state['size'] == stat.st_size):
+        return False
+    
+    try:
+        with open(fullpath, 'rb') as source_file:
+            haml_bytes = source_file.read()
+    except IOError:
+        return False
+    content_hash = hashlib.sha1(haml_bytes).hexdigest()
+    
+    if state and output_exists and state['hash'] == content_hash:
+        # Touched, but not changed
+        state.update(mtime = stat.st_mtime, size = stat.st_size)
+        return True
+    
     if Options.VERBOSE:
-        print '%s %s -> %s' % (strftime("%H:%M:%S"), fullpath, outfile_name)
+        print '%s %s -> %s' % (strftime("%H:%M:%S"), fullpath, compiled_path)
     try:
-        if Options.DEBUG:
-            print "Compiling %s -> %s" % (fullpath, outfile_name)
-        haml_lines = codecs.open(fullpath, 'r', encoding = 'utf-8').read().splitlines()
-        compiler = hamlpy.Compiler(compiler_args)
-        output = compiler.process_lines(haml_lines)
-        outfile = codecs.open(outfile_name, 'w', encoding = 'utf-8')
-        outfile.write(output)
+        return CompileJob(fullpath, compiled_path, stat, content_hash, haml_source = haml_bytes.decode('utf-8'))
+    except UnicodeDecodeError, e:
+        return CompileJob(fullpath, compiled_path, stat, content_hash, error = e)
+
+def _record(job, folder):
+    """Updates the "compiled" dict with the outcome of a CompileJob"""
+    name = os.path.relpath(job.fullpath, folder)
+    failed = job.error is not None
+    compiled[job.fullpath] = {
+        'mtime': job.mtime,
+        'size': job.size,
+        # Failed files are compiled again after a restart
+        'hash': None if failed else job.content_hash,
+        'dependencies': [] if failed else job.dependencies,
+    }
+    if not failed:
+        dependency_index.update(name, job.dependencies)
+    _report_affected(name)
+
+def _compile_in_worker(args):
+    """Compiles one file, possibly in a worker process. Returns the templates
+    it depends on, whether the output was written and the error it failed
+    with, if any."""
+    fullpath, outfile_name, compiler_args, haml_source = args
+    if Options.DEBUG:
+        print "Compiling %s -> %s" % (fullpath, outfile_name)
+    try:
+        return _compile_source(haml_source, outfile_name, compiler_args) + (None,)
     except Exception, e:
-        # import traceback
-        print "Failed to compile %s -> %s\nReason:\n%s" % (fullpath, outfile_name, e)
-        # print traceback.print_exc()
+        return None, False, '%s' % e
+
+def _init_worker(self_closing, may_contain, cache):
+    init_worker(self_closing, may_contain)
+    # Workers may not inherit the cache either
+    Options.CACHE = cache
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = multiprocessing.Pool(Options.JOBS, _init_worker,
+                                     (hamlpynodes.TagNode.self_closing, hamlpynodes.TagNode.may_contain, Options.CACHE))
+    return _pool
+
+def _close_pool(terminate = False):
+    global _pool
+    if _pool is not None:
+        if terminate:
+            _pool.terminate()
+        else:
+            _pool.close()
+        _pool.join()
+        _pool = None
+
+def _source_removed(fullpath, folder, destination):
+    """Removes the output of a deleted source file"""
+    name = os.path.relpath(fullpath, folder)
+    compiled_path = _compiled_path(os.path.join(destination, os.path.dirname(name)), os.path.basename(name))
+    if Options.VERBOSE:
+        print '%s %s removed, deleting %s' % (strftime("%H:%M:%S"), fullpath, compiled_path)
+    if os.path.isfile(compiled_path):
+        os.remove(compiled_path)
+    del compiled[fullpath]
+    dependency_index.remove(name)
+    _report_affected(name)
+    return True
+
+def _report_affected(name):
+    """Lists the templates extending or including a changed template"""
+    if Options.VERBOSE:
+        affected = dependency_index.affected(name)
+        if affected:
+            print '    affects %s' % ', '.join(sorted(affected))
+
+def _settings(compiler_args):
+    """Describes the options that affect the compiled files"""
+    return hashlib.sha1(settings_key(compiler_args, splitlines = True) + Options.OUTPUT_EXT).hexdigest()
+
+def _load_state(folder, destination, compiler_args):
+    """Restores the "compiled" dict saved by a previous run, unless the
+    compiler options changed since"""
+    try:
+        with open(os.path.join(destination, Options.STATE_FILE)) as state_file:
+            state = json.load(state_file)
+    except (IOError, ValueError):
+        return
+    if state.get('settings') != _settings(compiler_args):
+        return
+    
+    for name, file_state in state.get('files', {}).items():
+        compiled[os.path.join(folder, name)] = file_state
+        dependency_index.update(name, file_state['dependencies'])
+
+def _save_state(folder, destination, compiler_args):
+    files = dict((os.path.relpath(fullpath, folder), file_state)
+                 for fullpath, file_state in compiled.items())
+    state = {'settings': _settings(compiler_args), 'files': files}
+    try:
+        atomic_write(os.path.join(destination, Options.STATE_FILE), json.dumps(state, sort_keys = True))
+    except (IOError, OSError), e:
+        print "Failed to save watcher state: %s" % e
+
+def _compiled_path(destination, filename):
+    return os.path.join(destination, filename[:filename.rfind('.')] + Options.OUTPUT_EXT)
+
+def _compile_source(haml_source, outfile_name, compiler_args):
+    """Compiles haml_source to outfile_name, leaving it alone if it already
+    has the compiled HTML. Returns the templates it depends on and whether
+    the output was written."""
+    if Options.CACHE:
+        output = Options.CACHE.compile(haml_source, compiler_args, splitlines = True)
+        dependencies = hamlpy.find_dependencies(haml_source.splitlines())
+    else:
+        compiler = hamlpy.Compiler(compiler_args)
+        output = compiler.process_lines(haml_source.splitlines())
+        dependencies = compiler.dependencies
+    return dependencies, write_if_changed(outfile_name, output)
 
 if __name__ == '__main__':
     watch_folder()
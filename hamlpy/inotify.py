@@ -0,0 +1,171 @@
+'''
+Minimal ctypes binding to Linux inotify, used by hamlpy-watcher to react to
+file changes instead of polling the watched folder.
+'''
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyUnavailable(Exception):
+    pass
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        raise InotifyUnavailable('inotify is only available on Linux')
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError), e:
+        raise InotifyUnavailable('libc does not provide inotify: %s' % e)
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class Inotify(object):
+    '''Watches directory trees and reports the paths changed inside them'''
+
+    def __init__(self):
+        self._libc = _load_libc()
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise InotifyUnavailable(os.strerror(ctypes.get_errno()))
+        # watch descriptor -> watched directory
+        self.directories = {}
+        # Set when the kernel dropped events; the watcher must rescan
+        self.overflowed = False
+        # Encoding of paths, which are given as bytes to inotify and by it
+        self.encoding = sys.getfilesystemencoding()
+
+    def add_tree(self, folder):
+        '''Watches folder and all folders below it. Returns the paths of the
+        files found, as they may have been created before the watch started'''
+        found = []
+        for dirpath, dirnames, filenames in os.walk(folder):
+            self._add_watch(dirpath)
+            found.extend(os.path.join(dirpath, filename) for filename in filenames)
+        return found
+
+    def _add_watch(self, directory):
+        path = directory.encode(self.encoding) if isinstance(directory, unicode) else directory
+        wd = self._libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                # Removed before we got to it
+                return
+            if error in (errno.ENOSPC, errno.EMFILE):
+                # The tree can't be watched as a whole, so polling it is the
+                # only way to see every change
+                raise InotifyUnavailable('cannot watch %s: %s (see fs.inotify.max_user_watches)' % (
+                    directory, os.strerror(error)))
+            raise OSError(error, os.strerror(error), directory)
+        self.directories[wd] = directory
+
+    def read(self, timeout=None):
+        '''Waits up to timeout seconds (forever if None) and returns the set
+        of paths created, changed, moved or deleted since the last read'''
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return changed
+            raise
+
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            directory = self.directories.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.directories[wd]
+                continue
+            if not name:
+                # Event on the watched directory itself
+                continue
+            if isinstance(directory, unicode):
+                try:
+                    name = name.decode(self.encoding)
+                except UnicodeDecodeError:
+                    # Like os.walk, which leaves it undecoded, a unicode tree
+                    # has no path for it
+                    continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self.add_tree(path))
+                elif mask & (IN_MOVED_FROM | IN_DELETE):
+                    # Its contents are gone from the watched tree as well
+                    changed.update(self._forget_tree(path))
+            else:
+                changed.add(path)
+        return changed
+
+    def _forget_tree(self, folder):
+        prefix = folder + os.sep
+        for wd, directory in self.directories.items():
+            if directory == folder or directory.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self.directories[wd]
+        return [folder]
+
+    def wait(self, settle=0.1, max_delay=1.0):
+        '''Blocks until something changes, then keeps collecting changes until
+        none arrive for settle seconds (or max_delay passed), so the burst of
+        events caused by one editor save or checkout is handled at once'''
+        changed = self.read()
+        deadline = time.time() + max_delay
+        while time.time() < deadline:
+            more = self.read(settle)
+            if not more:
+                break
+            changed.update(more)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
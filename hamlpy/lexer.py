@@ -0,0 +1,92 @@
+'''
+Splits HamlPy source into tokens, one for each logical line: a blank line, a
+line that becomes a node, or the lines of an element whose attributes span
+several lines.
+
+The source is read once from top to bottom. Every token already knows the
+class of the node it becomes, so the tree builder only has to place nodes,
+and tools can look at the structure of a template without building a tree:
+
+    for token in tokenize(haml_source.split('\\n')):
+        print token.start, token.kind, token.text
+'''
+from attributes import brace_depth, closing_brace
+from elements import Element
+from nodes import ElementNode, FilterNode, PlaintextNode, node_class
+
+
+class Token(object):
+    '''A logical line of a template'''
+    __slots__ = ('kind', 'text', 'indentation', 'start', 'end')
+
+    def __init__(self, kind, text, indentation, start, end):
+        # Class of the node for the line, None for blank lines
+        self.kind = kind
+        # The line with its indentation, lines of multi-line elements joined
+        self.text = text
+        self.indentation = indentation
+        # Numbers of the first and last line, counting from 1
+        self.start = start
+        self.end = end
+
+    def node(self):
+        '''Returns a new node for the token, or None for blank lines'''
+        if self.kind is None:
+            return None
+        return self.kind(self.text)
+
+    def __repr__(self):
+        name = self.kind.__name__ if self.kind else 'Blank'
+        return '(%s lines %d-%d in=%d: %s)' % (name, self.start, self.end, self.indentation, self.text.strip())
+
+
+def tokenize(haml_lines):
+    '''Yields the Tokens of the given lines, in order'''
+    line_iter = iter(haml_lines)
+    # Indentation of the filter the lines are in, None outside filters
+    filter_indentation = None
+    line_number = 0
+
+    for line in line_iter:
+        line_number += 1
+        stripped_line = line.strip()
+        if not stripped_line:
+            # Blank lines don't end filters
+            yield Token(None, line, 0, line_number, line_number)
+            continue
+
+        indentation = len(line) - len(line.lstrip())
+        if filter_indentation is not None and indentation > filter_indentation:
+            # Filter content is kept as it is
+            yield Token(PlaintextNode, line, indentation, line_number, line_number)
+            continue
+        filter_indentation = None
+
+        start = line_number
+        node_lines = line
+        kind = node_class(stripped_line)
+        if kind is ElementNode and _attributes_left_open(stripped_line):
+            # Attributes continue until their braces are balanced
+            depth, quote = brace_depth(line)
+            parts = [line]
+            while depth > 0:
+                try:
+                    line = line_iter.next()
+                except StopIteration:
+                    raise Exception('No closing brace found for multi-line HAML beginning at line %s' % start)
+                line_number += 1
+                parts.append(line)
+                depth, quote = brace_depth(line, depth, quote)
+            node_lines = ''.join(parts)
+
+        if issubclass(kind, FilterNode):
+            filter_indentation = indentation
+        yield Token(kind, node_lines, indentation, start, line_number)
+
+
+def _attributes_left_open(stripped_line):
+    '''Returns whether the attributes of an element line are not closed on
+    the line. Other braces, e.g. of variables in the inline content, never
+    make an element span several lines.'''
+    head = Element.HEAD_REGEX.match(stripped_line)
+    return bool(head.group(4)) and closing_brace(stripped_line, head.end() - 1) == -1
@@ -0,0 +1,43 @@
+'''
+The manifest written by hamlpy-build, which maps the content hash of every
+template (see hamlpy.cache.cache_key) to the HTML compiled from it. Kept apart
+from hamlpy.build so the template loaders can read it without importing the
+command line tools.
+'''
+import json
+import os
+
+MANIFEST_NAME = 'hamlpy-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+class Manifest(object):
+    '''Read access to the prebuilt templates recorded in a build manifest'''
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self._artifacts = None
+
+    def artifact_path(self, source_hash):
+        '''Returns the path of the HTML compiled from the source with the given
+        hash, or None when the build did not produce it'''
+        if self._artifacts is None:
+            self.reload()
+        output = self._artifacts.get(source_hash)
+        return os.path.join(self.directory, output) if output else None
+
+    def reload(self):
+        manifest = load_manifest(self.path)
+        self._artifacts = manifest.get('artifacts', {}) if manifest else {}
@@ -0,0 +1,234 @@
+'''
+Counts and times the templates compiled by the Django loaders and the Jinja2
+extension, so the time requests spend compiling HamlPy can be monitored.
+
+Nothing is recorded until a sink is added. Sinks receive every counter
+increment and every observed value:
+
+    class StatsdSink(object):
+        def increment(self, name, labels, value=1):
+            statsd.incr(name, value)
+
+        def observe(self, name, labels, value):
+            statsd.timing(name, value)
+
+    metrics.add_sink(StatsdSink())
+
+PrometheusSink keeps the totals and histograms, and dumps them in the
+Prometheus text format; LoggingSink logs every value. With Django they can be
+set up with HAMLPY_METRICS_SINKS, a list of sinks or of import paths of sink
+classes, e.g. ['hamlpy.metrics.LoggingSink'].
+
+Metrics, labelled with the loader ('jinja2' for the Jinja2 extension):
+
+    hamlpy_compiles_total               templates compiled, not taken from a cache
+    hamlpy_compile_failures_total       templates failing to compile
+    hamlpy_compile_seconds              histogram of the time taken to compile
+    hamlpy_source_bytes                 histogram of the size of the HamlPy source
+    hamlpy_output_bytes                 histogram of the size of the HTML
+    hamlpy_template_not_found_total     template names the loader does not have
+    hamlpy_miss_cache_hits_total        of those, the ones known to be missing
+
+and, as the compile cache is shared by all loaders, without labels:
+
+    hamlpy_compile_cache_hits_total
+    hamlpy_compile_cache_misses_total
+'''
+import importlib
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HELP = {
+    'hamlpy_compiles_total': 'HamlPy templates compiled, not taken from a cache',
+    'hamlpy_compile_failures_total': 'HamlPy templates failing to compile',
+    'hamlpy_compile_seconds': 'Time taken to compile HamlPy templates',
+    'hamlpy_source_bytes': 'Size of the source of compiled HamlPy templates',
+    'hamlpy_output_bytes': 'Size of the HTML of compiled HamlPy templates',
+    'hamlpy_template_not_found_total': 'Template names a HamlPy loader does not have',
+    'hamlpy_miss_cache_hits_total': 'HamlPy templates known to be missing without looking for them',
+    'hamlpy_compile_cache_hits_total': 'HamlPy templates found in the compile cache',
+    'hamlpy_compile_cache_misses_total': 'HamlPy templates missing from the compile cache',
+}
+
+# Receivers of the metrics, see add_sink
+sinks = []
+
+
+def add_sink(sink):
+    if sink not in sinks:
+        sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in sinks:
+        sinks.remove(sink)
+
+
+def load_sink(sink):
+    '''Returns sink, or a new instance of the sink class at the import path
+    sink, e.g. 'hamlpy.metrics.PrometheusSink' '''
+    if not isinstance(sink, basestring):
+        return sink
+    module_name, _, class_name = sink.rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def increment(name, labels=None, value=1):
+    for sink in sinks:
+        sink.increment(name, labels or {}, value)
+
+
+def observe(name, value, labels=None):
+    for sink in sinks:
+        sink.observe(name, labels or {}, value)
+
+
+def timed_compile(loader, compile, haml_source, *args):
+    '''Returns compile(haml_source, *args), recording the compile under the
+    name of the loader'''
+    if not sinks:
+        return compile(haml_source, *args)
+
+    labels = {'loader': loader}
+    start = time.time()
+    try:
+        html = compile(haml_source, *args)
+    except Exception:
+        increment('hamlpy_compile_failures_total', labels)
+        raise
+    elapsed = time.time() - start
+
+    increment('hamlpy_compiles_total', labels)
+    observe('hamlpy_compile_seconds', elapsed, labels)
+    observe('hamlpy_source_bytes', _size(haml_source), labels)
+    observe('hamlpy_output_bytes', _size(html), labels)
+    return html
+
+
+def _size(text):
+    if isinstance(text, unicode):
+        return len(text.encode('utf-8'))
+    return len(text)
+
+
+class PrometheusSink(object):
+    '''Keeps the totals of the counters and histograms of the observed values'''
+
+    def __init__(self, buckets=None):
+        # Upper bounds of the histogram buckets by metric, by default
+        # SECONDS_BUCKETS or BYTES_BUCKETS depending on the name
+        self.buckets = buckets or {}
+        self._counters = {}
+        # Metric and labels -> [bucket counts, sum, count]
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self._buckets(name)
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(buckets), 0, 0]
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def _buckets(self, name):
+        if name in self.buckets:
+            return self.buckets[name]
+        return BYTES_BUCKETS if name.endswith('_bytes') else SECONDS_BUCKETS
+
+    def counter(self, name, **labels):
+        '''Returns the total of a counter'''
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name, **labels):
+        '''Returns the sum and the number of the values observed'''
+        histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+        if histogram is None:
+            return 0, 0
+        return histogram[1], histogram[2]
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def dump(self):
+        '''Returns the metrics in the Prometheus text exposition format'''
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(counts), total, count))
+                                for key, (counts, total, count) in self._histograms.items())
+
+        lines = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.extend(_header(name, 'counter'))
+                last_name = name
+            lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+
+        for (name, labels), (counts, total, count) in histograms:
+            if name != last_name:
+                lines.extend(_header(name, 'histogram'))
+                last_name = name
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets(name), counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (name, _labels(labels + (('le', _number(bound)),)), cumulative))
+            lines.append('%s_bucket%s %d' % (name, _labels(labels + (('le', '+Inf'),)), count))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), _number(total)))
+            lines.append('%s_count%s %d' % (name, _labels(labels), count))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+def _header(name, kind):
+    lines = []
+    if name in HELP:
+        lines.append('# HELP %s %s' % (name, HELP[name]))
+    lines.append('# TYPE %s %s' % (name, kind))
+    return lines
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class LoggingSink(object):
+    '''Logs every value, by default to the hamlpy.metrics logger'''
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('hamlpy.metrics')
+        self.level = level
+
+    def increment(self, name, labels, value=1):
+        self.logger.log(self.level, '%s%s +%s', name, _labels(tuple(sorted(labels.items()))), value)
+
+    def observe(self, name, labels, value):
+        self.logger.log(self.level, '%s%s %s', name, _labels(tuple(sorted(labels.items()))), _number(value))
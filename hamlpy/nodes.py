@@ -2,7 +2,7 @@ import re
 import sys
 from StringIO import StringIO
 
-from elements import Element
+from elements import parse_element
 
 try:
     from pygments import highlight
@@ -50,90 +50,108 @@ ELEMENT_CHARACTERS = (ELEMENT, ID, CLASS)
 
 HAML_ESCAPE = '\\'
 
+# Ends of rendered text to trim, see RootNode.render
+_STRIP_LEFT = 1
+_STRIP_RIGHT = 2
+_STRIP_BOTH = _STRIP_LEFT | _STRIP_RIGHT
+
+# Neither inner nor outer whitespace removal, see RootNode._whitespace_removal
+_NO_REMOVAL = (False, False)
+
+def _strip(text, strip):
+    if strip == _STRIP_BOTH:
+        return text.strip()
+    if strip == _STRIP_LEFT:
+        return text.lstrip()
+    if strip == _STRIP_RIGHT:
+        return text.rstrip()
+    return text
+
 def create_node(haml_line):
     stripped_line = haml_line.strip()
 
     if len(stripped_line) == 0:
         return None
 
-    if re.match(INLINE_VARIABLE, stripped_line) or re.match(ESCAPED_INLINE_VARIABLE, stripped_line):
-        return PlaintextNode(haml_line)
-
-    if stripped_line[0] == HAML_ESCAPE:
-        return PlaintextNode(haml_line)
-
-    if stripped_line.startswith(DOCTYPE):
-        return DoctypeNode(haml_line)
-
-    if stripped_line[0] in ELEMENT_CHARACTERS:
-        return ElementNode(haml_line)
+    return node_class(stripped_line)(haml_line)
 
-    if stripped_line[0:len(CONDITIONAL_COMMENT)] == CONDITIONAL_COMMENT:
-        return ConditionalCommentNode(haml_line)
+def node_class(stripped_line):
+    '''Returns the class of the node for a line, given without surrounding
+    whitespace. Most lines are told apart by their first character.'''
+    first = stripped_line[0]
 
-    if stripped_line[0] == HTML_COMMENT:
-        return CommentNode(haml_line)
+    # Lines starting with an inline variable, e.g. #{greeting}, are text
+    if stripped_line[1:2] == '{' and first in '#=' and INLINE_VARIABLE.match(stripped_line):
+        return PlaintextNode
 
-    for comment_prefix in HAML_COMMENTS:
-        if stripped_line.startswith(comment_prefix):
-            return HamlCommentNode(haml_line)
+    if first == '/':
+        if stripped_line.startswith(CONDITIONAL_COMMENT):
+            return ConditionalCommentNode
+        return CommentNode
 
-    if stripped_line[0] == VARIABLE:
-        return VariableNode(haml_line)
+    if stripped_line[:2] in HAML_COMMENTS:
+        return HamlCommentNode
 
-    if stripped_line[0] == TAG:
-        return TagNode(haml_line)
+    if first == '!' and stripped_line.startswith(DOCTYPE):
+        return DoctypeNode
 
-    if stripped_line == JAVASCRIPT_FILTER:
-        return JavascriptFilterNode(haml_line)
+    cls = _FIRST_CHARACTER_NODES.get(first)
+    if cls is not None:
+        return cls
 
-    if stripped_line in COFFEESCRIPT_FILTERS:
-        return CoffeeScriptFilterNode(haml_line)
+    return _FILTER_NODES.get(stripped_line, PlaintextNode)
 
-    if stripped_line == CSS_FILTER:
-        return CssFilterNode(haml_line)
+class NodeOptions(object):
+    '''Compiler options, shared by all nodes of a tree'''
+    __slots__ = ('attr_wrapper',)
 
-    if stripped_line == STYLUS_FILTER:
-        return StylusFilterNode(haml_line)
-
-    if stripped_line == PLAIN_FILTER:
-        return PlainFilterNode(haml_line)
-
-    if stripped_line == PYTHON_FILTER:
-        return PythonFilterNode(haml_line)
-
-    if stripped_line == CDATA_FILTER:
-        return CDataFilterNode(haml_line)
-
-    if stripped_line == PYGMENTS_FILTER:
-        return PygmentsFilterNode(haml_line)
-
-    if stripped_line == MARKDOWN_FILTER:
-        return MarkdownFilterNode(haml_line)
+    def __init__(self, attr_wrapper="'"):
+        self.attr_wrapper = attr_wrapper
 
-    return PlaintextNode(haml_line)
+DEFAULT_OPTIONS = NodeOptions()
 
 class TreeNode(object):
     ''' Generic parent/child tree class'''
+    # Templates can have tens of thousands of nodes, so nodes have no __dict__
+    __slots__ = ('parent', 'children', 'index')
+
     def __init__(self):
         self.parent = None
         self.children = []
+        # Position in parent.children, so siblings are found without a search
+        self.index = 0
+
+    def _sibling_index(self):
+        siblings = self.parent.children
+        if self.index < len(siblings) and siblings[self.index] is self:
+            return self.index
+        # The children list was changed without add_child
+        return siblings.index(self)
 
     def left_sibling(self):
         siblings = self.parent.children
-        index = siblings.index(self)
+        index = self._sibling_index()
         return siblings[index - 1] if index > 0 else None
 
     def right_sibling(self):
         siblings = self.parent.children
-        index = siblings.index(self)
+        index = self._sibling_index()
         return siblings[index + 1] if index < len(siblings) - 1 else None
 
     def add_child(self, child):
         child.parent = self
+        child.index = len(self.children)
         self.children.append(child)
 
 class RootNode(TreeNode):
+    __slots__ = ('indentation', 'newlines', 'before', 'after', 'options')
+
+    # Indicates that a node does not render anything (for whitespace removal)
+    empty_node = False
+    # Whether rendering goes on with the children of the node; nodes which
+    # render their children themselves, or leave them out, turn this off
+    renders_children = True
+
     def __init__(self, attr_wrapper="'"):
         TreeNode.__init__(self)
         self.indentation = -2
@@ -143,64 +161,158 @@ class RootNode(TreeNode):
         self.before = ''
         # Rendered text at end of node, e.g. "\n</p>"
         self.after = ''
-        # Indicates that a node does not render anything (for whitespace removal)
-        self.empty_node = False
 
         # Options
-        self.attr_wrapper = attr_wrapper
+        self.options = NodeOptions(attr_wrapper)
+
+    @property
+    def attr_wrapper(self):
+        return self.options.attr_wrapper
 
     def add_child(self, child):
-        '''Add child node, and copy all options to it'''
+        '''Add child node, and share the options with it'''
         super(RootNode, self).add_child(child)
-        child.attr_wrapper = self.attr_wrapper
+        child.options = self.options
+
+    def render(self, render_node=None):
+        '''Renders the tree and returns its HTML. The tree is walked once:
+        entering a node renders its children, which tells whether they remove
+        whitespace (< and >), so the text of the node and its children can be
+        trimmed as it is added to the output. render_node, if given, is called
+        to render each node instead, e.g. to time it.'''
+        return self._generate_html([(self, 0, 0, True, 0)], render_node)
+
+    def render_subtree(self, node, left_sibling=None, right_sibling=None):
+        '''Renders node, a child of this node, and returns its HTML as render
+        would with the given siblings next to it. The siblings need not be
+        rendered. Lets a tree be rendered a top-level node at a time.'''
+        node._render()
+        before_strip = after_strip = 0
+        inner, outer = node._whitespace_removal()
+        if inner:
+            before_strip |= _STRIP_RIGHT
+            after_strip |= _STRIP_LEFT
+        if outer or (left_sibling is not None and left_sibling._whitespace_removal()[1]):
+            before_strip |= _STRIP_LEFT
+        if outer or (right_sibling is not None and right_sibling._whitespace_removal()[1]):
+            after_strip |= _STRIP_RIGHT
+        return self._generate_html([(node, before_strip, after_strip, True, 0)])
+
+    def _generate_html(self, stack, render_node=None):
+        output = []
+        # Holds the nodes still to enter, with the ends of their text to trim,
+        # and the trimmed text ending the nodes whose children are being
+        # generated
+        while stack:
+            item = stack.pop()
+            if item.__class__ is not tuple:
+                output.append(item)
+                continue
+
+            node, before_strip, after_strip, rendered, inner_strip = item
+            entries = ()
+            if node.children:
+                if rendered and node.renders_children:
+                    if render_node is None:
+                        for child in node.children:
+                            child._render()
+                    else:
+                        for child in node.children:
+                            render_node(child)
+                entries, first_outer, last_outer = node._child_entries(rendered, inner_strip)
+                # Children removing the whitespace around them trim the node
+                if first_outer:
+                    before_strip |= _STRIP_RIGHT
+                if last_outer:
+                    after_strip |= _STRIP_LEFT
+
+            output.append(_strip(node.before, before_strip))
+            stack.append(_strip(node.after, after_strip))
+            stack.extend(reversed(entries))
+        return ''.join(output)
 
-    def render(self):
-        # Render (sets self.before and self.after)
-        self._render_children()
-        # Post-render (nodes can modify the rendered text of other nodes)
-        self._post_render()
-        # Generate HTML
-        return self._generate_html()
+    def _child_entries(self, rendered, inner_strip):
+        '''Returns the stack entries of the children for render, and whether
+        the first and last child remove the whitespace around them. inner_strip
+        tells which ends of the children to trim when the node is the empty
+        first or last child of a node removing whitespace inside it.'''
+        children = self.children
+        # Children left to their parent, e.g. filter content, have no
+        # whitespace removal of their own, and neither do their descendants
+        children_rendered = rendered and self.renders_children
+        if children_rendered:
+            removals = [child._whitespace_removal() for child in children]
+        else:
+            removals = [_NO_REMOVAL] * len(children)
+
+        first_strip = inner_strip & _STRIP_LEFT
+        last_strip = inner_strip & _STRIP_RIGHT
+        first_inner_strip = last_inner_strip = 0
+        if rendered and self._whitespace_removal()[0]:
+            # If a child renders nothing, its own children are trimmed instead
+            if children[0].empty_node:
+                first_inner_strip = _STRIP_LEFT
+            else:
+                first_strip |= _STRIP_LEFT
+            if children[-1].empty_node:
+                last_inner_strip = _STRIP_RIGHT
+            else:
+                last_strip |= _STRIP_RIGHT
+
+        entries = []
+        last = len(children) - 1
+        for index, child in enumerate(children):
+            inner, outer = removals[index]
+            before_strip = after_strip = child_inner_strip = 0
+            if inner:
+                before_strip |= _STRIP_RIGHT
+                after_strip |= _STRIP_LEFT
+            if outer:
+                before_strip |= _STRIP_LEFT
+                after_strip |= _STRIP_RIGHT
+
+            if index == 0:
+                before_strip |= first_strip
+                child_inner_strip |= first_inner_strip
+            elif removals[index - 1][1]:
+                before_strip |= _STRIP_LEFT
+            if index == last:
+                after_strip |= last_strip
+                child_inner_strip |= last_inner_strip
+            elif removals[index + 1][1]:
+                after_strip |= _STRIP_RIGHT
+
+            entries.append((child, before_strip, after_strip, children_rendered, child_inner_strip))
+        return entries, removals[0][1], removals[-1][1]
+
+    def _whitespace_removal(self):
+        '''Returns whether the node removes the whitespace inside it (<) and
+        around it (>)'''
+        return _NO_REMOVAL
 
     def render_newlines(self):
         return '\n' * (self.newlines + 1)
 
     def parent_of(self, node):
-        if (self._should_go_inside_last_node(node)):
-            ret = self.children[-1].parent_of(node)
-            return ret
-        else:
-            return self
+        parent = self
+        while parent._should_go_inside_last_node(node):
+            parent = parent.children[-1]
+        return parent
 
     def inside_filter_node(self):
-        if self.parent:
-            return self.parent.inside_filter_node()
-        else:
-            return False
-
-    def _render_children(self):
-        for child in self.children:
-            child._render()
-
-    def _post_render(self):
-        for child in self.children:
-            child._post_render()
-
-    def _generate_html(self):
-        output = []
-        output.append(self.before)
-        for child in self.children:
-            output.append(child.before)
-            output += [gc._generate_html() for gc in child.children]
-            output.append(child.after)
-        output.append(self.after)
-        return ''.join(output)
+        node = self
+        while node is not None:
+            if isinstance(node, FilterNode):
+                return True
+            node = node.parent
+        return False
 
     def add_node(self, node):
-        if (self._should_go_inside_last_node(node)):
-            self.children[-1].add_node(node)
-        else:
-            self.add_child(node)
+        parent = self
+        # Filter nodes keep everything below them as their own children
+        while not isinstance(parent, FilterNode) and parent._should_go_inside_last_node(node):
+            parent = parent.children[-1]
+        parent.add_child(node)
 
     def _should_go_inside_last_node(self, node):
         return len(self.children) > 0 and (node.indentation > self.children[-1].indentation
@@ -210,30 +322,96 @@ class RootNode(TreeNode):
         return False
 
     def debug_tree(self):
-        return '\n'.join(self._debug_tree([self]))
-
-    def _debug_tree(self, nodes):
         output = []
-        for n in nodes:
+        stack = [self]
+        while stack:
+            n = stack.pop()
             output.append('%s%s' % (' ' * (n.indentation + 2), n))
-            if n.children:
-                output += self._debug_tree(n.children)
-        return output
+            stack.extend(reversed(n.children))
+        return '\n'.join(output)
 
     def __repr__(self):
         return '(%s)' % (self.__class__)
 
+class TreeCursor(object):
+    '''Finds where each new line goes while a tree is built from top to bottom.
+
+    Only the last node added at each depth can receive new children, so the
+    candidates are kept on a stack, which is the chain of last children below
+    the root. Finding the parent of a node pops the candidates it is too
+    shallow to go inside, giving the same result as RootNode.add_node without
+    walking down from the root for every line.'''
+    __slots__ = ('stack',)
+
+    def __init__(self, root):
+        self.stack = [root]
+
+    def _pop_deeper(self, indentation):
+        stack = self.stack
+        # Nodes indented deeper than this line can never be entered again
+        while len(stack) > 1 and stack[-1].indentation > indentation:
+            stack.pop()
+
+    def _parent_index(self, node):
+        stack = self.stack
+        self._pop_deeper(node.indentation)
+        # Enter nodes at the same indentation only while they contain the node
+        # (e.g. "- else" goes inside "- if")
+        index = len(stack) - 1
+        while index > 0 and stack[index].indentation == node.indentation:
+            index -= 1
+        while (index + 1 < len(stack) and stack[index + 1].indentation == node.indentation
+               and stack[index + 1].should_contain(node)):
+            index += 1
+        # Filter nodes keep everything below them as their own children
+        if index > 0 and isinstance(stack[index - 1], FilterNode):
+            index -= 1
+        return index
+
+    def parent_of(self, node):
+        return self.stack[self._parent_index(node)]
+
+    def inside_filter_node(self, indentation):
+        '''Returns True if a line with the given indentation is part of a
+        filter, like RootNode.parent_of(node).inside_filter_node()'''
+        stack = self.stack
+        self._pop_deeper(indentation)
+        index = len(stack) - 1
+        while index > 0 and stack[index].indentation == indentation:
+            index -= 1
+        return isinstance(stack[index], FilterNode) or (index > 0 and isinstance(stack[index - 1], FilterNode))
+
+    def add_node(self, node):
+        index = self._parent_index(node)
+        self.stack[index].add_child(node)
+        del self.stack[index + 1:]
+        self.stack.append(node)
+
 class HamlNode(RootNode):
+    __slots__ = ('haml', 'raw_haml')
+
     def __init__(self, haml):
-        RootNode.__init__(self)
+        TreeNode.__init__(self)
         self.haml = haml.strip()
         self.raw_haml = haml
         self.indentation = (len(haml) - len(haml.lstrip()))
-        self.spaces = ''.join(haml[0] for i in range(self.indentation))
+        self.newlines = 0
+        self.before = ''
+        self.after = ''
+        # Replaced by the options of the tree when the node is added to one
+        self.options = DEFAULT_OPTIONS
+
+    @property
+    def spaces(self):
+        '''The indentation of the node, made of its first whitespace character'''
+        return self.raw_haml[:1] * self.indentation
 
     def replace_inline_variables(self, content):
-        content = re.sub(INLINE_VARIABLE, r'{{ \2 }}', content)
-        content = re.sub(ESCAPED_INLINE_VARIABLE, r'\1', content)
+        # Both kinds of inline variables have braces
+        if '{' not in content:
+            return content
+        content = INLINE_VARIABLE.sub(r'{{ \2 }}', content)
+        content = ESCAPED_INLINE_VARIABLE.sub(r'\1', content)
         return content
 
     def __repr__(self):
@@ -241,6 +419,8 @@ class HamlNode(RootNode):
 
 class PlaintextNode(HamlNode):
     '''Node that is not modified or processed when rendering'''
+    __slots__ = ()
+
     def _render(self):
         text = self.replace_inline_variables(self.haml)
         # Remove escape character unless inside filter node
@@ -252,20 +432,21 @@ class PlaintextNode(HamlNode):
             self.before += self.render_newlines()
         else:
             self.after = self.render_newlines()
-        self._render_children()
 
 class ElementNode(HamlNode):
     '''Node which represents a HTML tag'''
+    __slots__ = ('element', 'django_variable')
+
     def __init__(self, haml):
         HamlNode.__init__(self, haml)
+        self.element = None
         self.django_variable = False
 
     def _render(self):
-        self.element = Element(self.haml, self.attr_wrapper)
+        self.element = parse_element(self.haml, self.attr_wrapper)
         self.django_variable = self.element.django_variable
         self.before = self._render_before(self.element)
         self.after = self._render_after(self.element)
-        self._render_children()
 
     def _render_before(self, element):
         '''Render opening tag and inline content'''
@@ -303,50 +484,13 @@ class ElementNode(HamlNode):
         else:
             return "</%s>\n" % (element.tag)
 
-    def _post_render(self):
-        # Inner whitespace removal
-        if self.element.nuke_inner_whitespace:
-            self.before = self.before.rstrip()
-            self.after = self.after.lstrip()
-
-            if self.children:
-                node = self
-                # If node renders nothing, do removal on its first child instead
-                if node.children[0].empty_node == True:
-                    node = node.children[0]
-                if node.children:
-                    node.children[0].before = node.children[0].before.lstrip()
-
-                node = self
-                if node.children[-1].empty_node == True:
-                    node = node.children[-1]
-                if node.children:
-                    node.children[-1].after = node.children[-1].after.rstrip()
-
-        # Outer whitespace removal
-        if self.element.nuke_outer_whitespace:
-            left_sibling = self.left_sibling()
-            if left_sibling:
-                # If node has left sibling, strip whitespace after left sibling
-                left_sibling.after = left_sibling.after.rstrip()
-                left_sibling.newlines = 0
-            else:
-                # If not, whitespace comes from it's parent node,
-                # so strip whitespace before the node
-                self.parent.before = self.parent.before.rstrip()
-                self.parent.newlines = 0
-
-            self.before = self.before.lstrip()
-            self.after = self.after.rstrip()
-
-            right_sibling = self.right_sibling()
-            if right_sibling:
-                right_sibling.before = right_sibling.before.lstrip()
-            else:
-                self.parent.after = self.parent.after.lstrip()
-                self.parent.newlines = 0
-
-        super(ElementNode, self)._post_render()
+    def _whitespace_removal(self):
+        element = self.element
+        if element is None:
+            # Also known before the node is rendered, e.g. for the next
+            # sibling when streaming
+            element = parse_element(self.haml, self.attr_wrapper)
+        return element.nuke_inner_whitespace, element.nuke_outer_whitespace
 
     def _render_inline_content(self, inline_content):
         if inline_content == None or len(inline_content) == 0:
@@ -359,15 +503,18 @@ class ElementNode(HamlNode):
             return self.replace_inline_variables(inline_content)
 
 class CommentNode(HamlNode):
+    __slots__ = ()
+
     def _render(self):
         self.after = "-->\n"
         if self.children:
             self.before = "<!-- %s" % (self.render_newlines())
-            self._render_children()
         else:
             self.before = "<!-- %s " % (self.haml.lstrip(HTML_COMMENT).strip())
 
 class ConditionalCommentNode(HamlNode):
+    __slots__ = ()
+
     def _render(self):
         conditional = self.haml[1: self.haml.index(']') + 1 ]
 
@@ -378,9 +525,11 @@ class ConditionalCommentNode(HamlNode):
             self.before = "<!--%s>%s" % (conditional, content)
 
         self.after = "<![endif]-->\n"
-        self._render_children()
 
 class DoctypeNode(HamlNode):
+    __slots__ = ()
+    renders_children = False
+
     def _render(self):
         doctype = self.haml.lstrip(DOCTYPE).strip()
 
@@ -406,13 +555,16 @@ class DoctypeNode(HamlNode):
         self.after = self.render_newlines()
 
 class HamlCommentNode(HamlNode):
+    __slots__ = ()
+    renders_children = False
+
     def _render(self):
         self.after = self.render_newlines()[1:]
 
-    def _post_render(self):
-        pass
-
 class VariableNode(ElementNode):
+    __slots__ = ()
+    renders_children = False
+
     def __init__(self, haml):
         ElementNode.__init__(self, haml)
         self.django_variable = True
@@ -422,10 +574,12 @@ class VariableNode(ElementNode):
         self.before = "%s%s" % (self.spaces, self._render_inline_content(tag_content))
         self.after = self.render_newlines()
 
-    def _post_render(self):
-        pass
+    def _whitespace_removal(self):
+        return _NO_REMOVAL
 
 class TagNode(HamlNode):
+    __slots__ = ('tag_statement', 'tag_name')
+
     self_closing = {'for':'endfor',
                     'if':'endif',
                     'ifchanged':'endifchanged',
@@ -448,6 +602,9 @@ class TagNode(HamlNode):
                    'for':'empty',
                    'with':'with'}
 
+    # Tags whose first argument names another template
+    dependency_tags = ('extends', 'include')
+
     def __init__(self, haml):
         HamlNode.__init__(self, haml)
         self.tag_statement = self.haml.lstrip(TAG).strip()
@@ -456,6 +613,19 @@ class TagNode(HamlNode):
         if (self.tag_name in self.self_closing.values()):
             raise TypeError("Do not close your Django tags manually.  It will be done for you.")
 
+    def dependency(self):
+        '''Returns the name of the template this tag extends or includes, or
+        None if it does neither or names the template with a variable'''
+        if self.tag_name not in self.dependency_tags:
+            return None
+        arguments = self.tag_statement.split(None, 2)
+        if len(arguments) < 2:
+            return None
+        name = arguments[1]
+        if len(name) > 2 and name[0] == name[-1] and name[0] in '"\'':
+            return name[1:-1]
+        return None
+
     def _render(self):
         self.before = "%s{%% %s %%}" % (self.spaces, self.tag_statement)
         if (self.tag_name in self.self_closing.keys()):
@@ -466,18 +636,32 @@ class TagNode(HamlNode):
                 self.before += self.render_newlines()
             else:
                 self.after = self.render_newlines()
-        self._render_children()
 
     def should_contain(self, node):
         return isinstance(node, TagNode) and node.tag_name in self.may_contain.get(self.tag_name, '')
 
 
-class FilterNode(HamlNode):
-    def add_node(self, node):
-        self.add_child(node)
+def use_jinja_tags():
+    '''Adjusts the tag tables to Jinja2, which lacks some of Django's block tags
+    and has block tags of its own'''
+    for k in ('ifchanged', 'ifequal', 'ifnotequal', 'autoescape', 'blocktrans',
+              'spaceless', 'comment', 'cache', 'localize', 'compress'):
+        TagNode.self_closing.pop(k, None)
+        TagNode.may_contain.pop(k, None)
 
-    def inside_filter_node(self):
-        return True
+    TagNode.self_closing.update({
+        'macro'  : 'endmacro',
+        'call'   : 'endcall',
+        'raw'    : 'endraw'
+    })
+
+    TagNode.may_contain['for'] = 'else'
+
+
+class FilterNode(HamlNode):
+    __slots__ = ()
+    # Don't render children of filter nodes as we don't want them to be interpreted as HAML
+    renders_children = False
 
     def _render_children_as_plain_text(self, remove_indentation = True):
         if self.children:
@@ -491,15 +675,10 @@ class FilterNode(HamlNode):
             child.before += child.haml
             child.after = child.render_newlines()
 
-    def _post_render(self):
-        # Don't post-render children of filter nodes as we don't want them to be interpreted as HAML
-        pass
-
 
 class PlainFilterNode(FilterNode):
-    def __init__(self, haml):
-        FilterNode.__init__(self, haml)
-        self.empty_node = True
+    __slots__ = ()
+    empty_node = True
 
     def _render(self):
         if self.children:
@@ -507,6 +686,8 @@ class PlainFilterNode(FilterNode):
         self._render_children_as_plain_text()
 
 class PythonFilterNode(FilterNode):
+    __slots__ = ()
+
     def _render(self):
         if self.children:
             self.before = self.render_newlines()[1:]
@@ -534,6 +715,8 @@ class PythonFilterNode(FilterNode):
             self.after = self.render_newlines()
 
 class JavascriptFilterNode(FilterNode):
+    __slots__ = ()
+
     def _render(self):
         self.before = '<script type=%(attr_wrapper)stext/javascript%(attr_wrapper)s>\n// <![CDATA[%(new_lines)s' % {
             'attr_wrapper': self.attr_wrapper,
@@ -543,6 +726,8 @@ class JavascriptFilterNode(FilterNode):
         self._render_children_as_plain_text(remove_indentation = False)
 
 class CoffeeScriptFilterNode(FilterNode):
+    __slots__ = ()
+
     def _render(self):
         self.before = '<script type=%(attr_wrapper)stext/coffeescript%(attr_wrapper)s>\n#<![CDATA[%(new_lines)s' % {
             'attr_wrapper': self.attr_wrapper,
@@ -552,6 +737,8 @@ class CoffeeScriptFilterNode(FilterNode):
         self._render_children_as_plain_text(remove_indentation = False)
 
 class CssFilterNode(FilterNode):
+    __slots__ = ()
+
     def _render(self):
         self.before = '<style type=%(attr_wrapper)stext/css%(attr_wrapper)s>\n/*<![CDATA[*/%(new_lines)s' % {
             'attr_wrapper': self.attr_wrapper,
@@ -561,6 +748,8 @@ class CssFilterNode(FilterNode):
         self._render_children_as_plain_text(remove_indentation = False)
 
 class StylusFilterNode(FilterNode):
+    __slots__ = ()
+
     def _render(self):
         self.before = '<style type=%(attr_wrapper)stext/stylus%(attr_wrapper)s>\n/*<![CDATA[*/%(new_lines)s' % {
             'attr_wrapper': self.attr_wrapper,
@@ -570,12 +759,16 @@ class StylusFilterNode(FilterNode):
         self._render_children_as_plain_text()
 
 class CDataFilterNode(FilterNode):
+    __slots__ = ()
+
     def _render(self):
         self.before = self.spaces + '<![CDATA[%s' % (self.render_newlines())
         self.after = self.spaces + ']]>\n'
         self._render_children_as_plain_text(remove_indentation = False)
 
 class PygmentsFilterNode(FilterNode):
+    __slots__ = ()
+
     def _render(self):
         if self.children:
             if not _pygments_available:
@@ -589,6 +782,8 @@ class PygmentsFilterNode(FilterNode):
             self.after = self.render_newlines()
 
 class MarkdownFilterNode(FilterNode):
+    __slots__ = ()
+
     def _render(self):
         if self.children:
             if not _markdown_available:
@@ -604,3 +799,27 @@ class MarkdownFilterNode(FilterNode):
             self.before += markdown( ''.join(lines))
         else:
             self.after = self.render_newlines()
+
+
+# Node classes by the first character of their lines, see node_class
+_FIRST_CHARACTER_NODES = {
+    ELEMENT: ElementNode,
+    ID: ElementNode,
+    CLASS: ElementNode,
+    HAML_ESCAPE: PlaintextNode,
+    VARIABLE: VariableNode,
+    TAG: TagNode,
+}
+
+# Filter node classes by the line starting them
+_FILTER_NODES = {
+    JAVASCRIPT_FILTER: JavascriptFilterNode,
+    CSS_FILTER: CssFilterNode,
+    STYLUS_FILTER: StylusFilterNode,
+    PLAIN_FILTER: PlainFilterNode,
+    PYTHON_FILTER: PythonFilterNode,
+    CDATA_FILTER: CDataFilterNode,
+    PYGMENTS_FILTER: PygmentsFilterNode,
+    MARKDOWN_FILTER: MarkdownFilterNode,
+}
+_FILTER_NODES.update(dict.fromkeys(COFFEESCRIPT_FILTERS, CoffeeScriptFilterNode))
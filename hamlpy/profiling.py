@@ -0,0 +1,87 @@
+'''
+Measures where a compile spends its time. Pass a callback to the Compiler to
+have it called with the CompileStats of every template it compiles:
+
+    compiler = hamlpy.Compiler(on_stats=lambda stats: sys.stderr.write(stats.report()))
+
+Rendering, removing whitespace and generating the HTML happen in one walk of
+the tree, so the time of the render phase is split into the time spent in the
+nodes (evaluating attributes, running filters, ...) and the rest, which is
+whitespace removal and output generation.
+'''
+import heapq
+import time
+from collections import OrderedDict
+
+
+class CompileStats(object):
+    '''The timings of one compile'''
+
+    def __init__(self, slowest=10):
+        # Seconds spent in each phase, in the order they ran
+        self.phases = OrderedDict()
+        # Nodes of each class in the tree, by class name
+        self.node_counts = {}
+        # Seconds spent rendering the nodes of each class, by class name
+        self.node_times = {}
+        # Number of nodes kept in slowest_nodes
+        self.slowest = slowest
+        # Heap of (seconds, line number, class name, source) of the slowest nodes
+        self._slowest = []
+        # Line numbers of the nodes in the tree being compiled
+        self.lines = {}
+
+    def add_phase(self, name, elapsed):
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count_nodes(self):
+        '''Counts the nodes of the tree by class, once it's built'''
+        for node in self.lines:
+            name = node.__class__.__name__
+            self.node_counts[name] = self.node_counts.get(name, 0) + 1
+
+    def render_node(self, node):
+        '''Renders node, timing it'''
+        start = time.time()
+        node._render()
+        elapsed = time.time() - start
+
+        name = node.__class__.__name__
+        self.node_times[name] = self.node_times.get(name, 0.0) + elapsed
+        entry = (elapsed, self.lines.get(node), name, node.haml)
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, entry)
+        elif self.slowest:
+            heapq.heappushpop(self._slowest, entry)
+
+    def finish(self):
+        '''Drops the references to the tree once the compile is done'''
+        self.lines = {}
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    @property
+    def slowest_nodes(self):
+        '''(seconds, line number, class name, source) of the slowest nodes,
+        slowest first'''
+        return sorted(self._slowest, reverse=True)
+
+    def report(self):
+        '''Returns the stats as text'''
+        lines = ['phases:']
+        for name, elapsed in self.phases.items():
+            lines.append('  %-10s %9.3f ms' % (name, elapsed * 1000))
+        lines.append('  %-10s %9.3f ms' % ('total', self.total * 1000))
+
+        lines.append('nodes:')
+        for name in sorted(self.node_counts, key=lambda name: -self.node_times.get(name, 0.0)):
+            lines.append('  %-22s %7d %9.3f ms' % (name, self.node_counts[name], self.node_times.get(name, 0.0) * 1000))
+
+        lines.append('slowest nodes:')
+        for elapsed, line, name, source in self.slowest_nodes:
+            if len(source) > 50:
+                source = source[:47] + '...'
+            lines.append('  line %-6s %9.3f ms  %s: %s' % (line, elapsed * 1000, name, source))
+        return '\n'.join(lines) + '\n'
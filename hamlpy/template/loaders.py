@@ -1,4 +1,6 @@
+import codecs
 import os
+import time
 
 try:
     from django.template import TemplateDoesNotExist
@@ -10,17 +12,142 @@ except ImportError, e:
 
     _django_available = False
 
-from hamlpy import hamlpy
+from hamlpy import hamlpy, metrics
+from hamlpy.manifest import Manifest
+from hamlpy.cache import cache_key, get_settings_cache
 from hamlpy.template.utils import get_django_template_loaders
+from hamlpy.utils import LRUCache
 
 
 # Get options from Django settings
 options_dict = {}
+compile_cache_enabled = True
+compile_cache_size = 256
+miss_cache_size = 1024
+miss_cache_ttl = 5
+build_manifest = None
 
 if _django_available:
     from django.conf import settings
     if hasattr(settings, 'HAMLPY_ATTR_WRAPPER'):
         options_dict.update(attr_wrapper=settings.HAMLPY_ATTR_WRAPPER)
+    compile_cache_enabled = getattr(settings, 'HAMLPY_COMPILE_CACHE', compile_cache_enabled)
+    compile_cache_size = getattr(settings, 'HAMLPY_COMPILE_CACHE_SIZE', compile_cache_size)
+    miss_cache_size = getattr(settings, 'HAMLPY_MISS_CACHE_SIZE', miss_cache_size)
+    miss_cache_ttl = getattr(settings, 'HAMLPY_MISS_CACHE_TTL', miss_cache_ttl)
+    build_manifest = getattr(settings, 'HAMLPY_BUILD_MANIFEST', build_manifest)
+    for sink in getattr(settings, 'HAMLPY_METRICS_SINKS', ()):
+        metrics.add_sink(metrics.load_sink(sink))
+
+# Compiled HTML of recently loaded templates, shared by all HamlPy loaders.
+# Keys hold the template path, the file's mtime and size and the compiler
+# options, so an edited file simply misses and its old entry ages out.
+compile_cache = LRUCache(compile_cache_size) if compile_cache_enabled else None
+
+# Cache shared with other processes, configured by HAMLPY_CACHE_DIR or
+# HAMLPY_DJANGO_CACHE
+persistent_cache = get_settings_cache()
+
+
+def _template_stamp(template_path, haml_source):
+    '''Identifies the current version of a template: its mtime and size, or
+    the source itself when the template does not come from a file'''
+    try:
+        stat = os.stat(template_path)
+    except (OSError, TypeError, ValueError):
+        return haml_source
+    return (stat.st_mtime, stat.st_size)
+
+
+def compile_template(haml_source, template_path, compile=None, variant=None):
+    '''Compiles HamlPy source to HTML, reusing the cached result when the
+    template has not changed since it was last compiled. compile, if given,
+    is called with the source to get the HTML instead, and variant keeps what
+    it returns apart from the HTML of other compile functions in the cache.'''
+    compile = compile or _compile
+    if compile_cache is None:
+        return compile(haml_source)
+
+    key = (template_path, _template_stamp(template_path, haml_source),
+           tuple(sorted(options_dict.items())), variant)
+    html = compile_cache.get(key)
+    if html is None:
+        metrics.increment('hamlpy_compile_cache_misses_total')
+        html = compile(haml_source)
+        compile_cache.set(key, html)
+    else:
+        metrics.increment('hamlpy_compile_cache_hits_total')
+    return html
+
+
+def _compile(haml_source, process=None):
+    '''Compiles HamlPy source, reusing the HTML in the persistent cache if
+    there is one. process, if given, is called with the source to compile it
+    when it has to be compiled.'''
+    process = process or _process
+    if persistent_cache is not None:
+        return persistent_cache.compile(haml_source, options_dict, compile=process)
+    return process(haml_source)
+
+
+def _process(haml_source):
+    return hamlpy.Compiler(options_dict=dict(options_dict)).process(haml_source)
+
+
+class MissCache(object):
+    '''Remembers the templates a loader does not have. A miss is trusted for
+    ttl seconds, and after that for another ttl seconds at a time as long as
+    the directories the template would be found in are unchanged. Misses
+    without directories are forgotten after ttl seconds.'''
+
+    def __init__(self, max_entries=1024, ttl=5):
+        self.ttl = ttl
+        # Key -> (time the miss is trusted until, mtimes of the directories)
+        self._entries = LRUCache(max_entries)
+
+    def add(self, key, directories=None):
+        self._entries.set(key, (time.time() + self.ttl, directories))
+
+    def is_missing(self, key, directories=lambda: None):
+        '''Returns whether the template of key is still known to be missing.
+        directories is called to get the current mtimes of its directories
+        once the miss is older than ttl.'''
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        trusted_until, mtimes = entry
+        if time.time() < trusted_until:
+            return True
+        if mtimes is not None and mtimes == directories():
+            self.add(key, mtimes)
+            return True
+        self._entries.delete(key)
+        return False
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _directory_mtimes(paths):
+    '''Returns the directories of paths with their mtimes, None for the ones
+    that don't exist'''
+    mtimes = []
+    for directory in sorted(set(os.path.dirname(path) for path in paths)):
+        try:
+            mtimes.append((directory, os.stat(directory).st_mtime))
+        except OSError:
+            mtimes.append((directory, None))
+    return tuple(mtimes)
+
+
+def _loader_name(loader):
+    '''Names loader in the metrics: the last part of the module name of
+    Django's loaders, e.g. filesystem, or the class name of other loaders'''
+    name = getattr(loader, '__name__', None) or loader.__class__.__name__
+    return name.rsplit('.', 1)[-1]
 
 
 def get_haml_loader(loader):
@@ -32,37 +159,110 @@ def get_haml_loader(loader):
                 return loader.load_template_source(*args, **kwargs)
 
     class Loader(baseclass):
+        def __init__(self, *args, **kwargs):
+            super(Loader, self).__init__(*args, **kwargs)
+            # Templates this loader does not have, so Django trying every
+            # loader for every template doesn't look for them again and again
+            self.miss_cache = MissCache(miss_cache_size, miss_cache_ttl) if miss_cache_size > 0 else None
+
         def load_template_source(self, template_name, *args, **kwargs):
             name, _extension = os.path.splitext(template_name)
             # os.path.splitext always returns a period at the start of extension
             extension = _extension.lstrip('.')
 
             if extension in hamlpy.VALID_EXTENSIONS:
-                try:
-                    haml_source, template_path = super(Loader, self).load_template_source(
-                        self._generate_template_name(name, extension), *args, **kwargs
-                    )
-                except TemplateDoesNotExist:
-                    pass
+                haml_name = self._generate_template_name(name, extension)
+                miss_key = (haml_name, repr(args), repr(sorted(kwargs.items())))
+                directories = lambda: self._template_directories(haml_name, *args, **kwargs)
+                if self.miss_cache is not None and self.miss_cache.is_missing(miss_key, directories):
+                    metrics.increment('hamlpy_miss_cache_hits_total', {'loader': self.metrics_name})
                 else:
-                    hamlParser = hamlpy.Compiler(options_dict=options_dict)
-                    html = hamlParser.process(haml_source)
-
-                    return html, template_path
+                    try:
+                        haml_source, template_path = super(Loader, self).load_template_source(
+                            haml_name, *args, **kwargs
+                        )
+                    except TemplateDoesNotExist:
+                        if self.miss_cache is not None:
+                            self.miss_cache.add(miss_key, directories())
+                    else:
+                        return self._compile(haml_source, template_path), template_path
 
+            metrics.increment('hamlpy_template_not_found_total', {'loader': self.metrics_name})
             raise TemplateDoesNotExist(template_name)
 
         load_template_source.is_usable = True
 
+        # Value of the loader label of the metrics
+        metrics_name = _loader_name(loader)
+
+        def _compile(self, haml_source, template_path):
+            return compile_template(haml_source, template_path, self._compile_missing)
+
+        def _compile_missing(self, haml_source):
+            '''Compiles a template missing from the compile cache. Only the
+            templates missing from the persistent cache too are timed.'''
+            return _compile(haml_source, self._timed_process)
+
+        def _timed_process(self, haml_source):
+            return metrics.timed_compile(self.metrics_name, _process, haml_source)
+
+        def _template_directories(self, template_name, *args, **kwargs):
+            '''Returns the directories the wrapped loader looks for
+            template_name in with their mtimes, or None when it can't tell'''
+            get_template_sources = getattr(super(Loader, self), 'get_template_sources', None)
+            if get_template_sources is None:
+                return None
+            try:
+                # Newer versions of Django yield Origins instead of paths
+                paths = [getattr(source, 'name', source)
+                         for source in get_template_sources(template_name, *args, **kwargs)]
+            except Exception:
+                return None
+            return _directory_mtimes(paths)
+
         def _generate_template_name(self, name, extension="hamlpy"):
             return "%s.%s" % (name, extension)
 
     return Loader
 
 
+def get_prebuilt_haml_loader(loader, manifest_path=None):
+    '''Returns a loader serving the HTML compiled ahead of time by hamlpy-build.
+
+    The source of every template is still loaded to look its hash up in the
+    manifest (manifest_path, or HAMLPY_BUILD_MANIFEST by default), so
+    templates changed since the build, or missing from it, are compiled as
+    usual.'''
+    manifest = Manifest(manifest_path or build_manifest) if (manifest_path or build_manifest) else None
+
+    class PrebuiltLoader(get_haml_loader(loader)):
+        def _compile(self, haml_source, template_path):
+            if manifest is None:
+                return super(PrebuiltLoader, self)._compile(haml_source, template_path)
+            # The artifacts are kept in the compile cache like compiled HTML,
+            # so they are not read from disk for every render
+            return compile_template(haml_source, template_path, self._load_artifact, manifest.path)
+
+        def _load_artifact(self, haml_source):
+            artifact_path = manifest.artifact_path(cache_key(haml_source, options_dict))
+            if artifact_path:
+                try:
+                    with codecs.open(artifact_path, 'r', encoding='utf-8') as artifact:
+                        return artifact.read()
+                except IOError:
+                    pass
+            return self._compile_missing(haml_source)
+
+    PrebuiltLoader.manifest = manifest
+    PrebuiltLoader.metrics_name = 'prebuilt_%s' % _loader_name(loader)
+    return PrebuiltLoader
+
+
 haml_loaders = dict((name, get_haml_loader(loader))
         for (name, loader) in get_django_template_loaders())
 
 if _django_available:
     HamlPyFilesystemLoader = get_haml_loader(filesystem)
     HamlPyAppDirectoriesLoader = get_haml_loader(app_directories)
+    HamlPyPrebuiltFilesystemLoader = get_prebuilt_haml_loader(filesystem)
+    HamlPyPrebuiltAppDirectoriesLoader = get_prebuilt_haml_loader(app_directories)
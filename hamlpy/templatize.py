@@ -13,16 +13,26 @@ except ImportError, e:
 
 import hamlpy
 import os
+from cache import get_settings_cache
 
 
 def decorate_templatize(func):
+    # Settings are only read once templatize is called, as they may not be
+    # configured yet when hamlpy is imported
+    persistent_cache = []
+
     def templatize(src, origin=None):
         #if the template has no origin file then do not attempt to parse it with haml
         if origin:
             #if the template has a source file, then only parse it if it is haml
             if os.path.splitext(origin)[1].lower() in ['.'+x.lower() for x in hamlpy.VALID_EXTENSIONS]:
-                hamlParser = hamlpy.Compiler()
-                html = hamlParser.process(src.decode('utf-8'))
+                if not persistent_cache:
+                    persistent_cache.append(get_settings_cache())
+                if persistent_cache[0] is not None:
+                    html = persistent_cache[0].compile(src.decode('utf-8'))
+                else:
+                    hamlParser = hamlpy.Compiler()
+                    html = hamlParser.process(src.decode('utf-8'))
                 src = html.encode('utf-8')
         return func(src, origin)
     return templatize
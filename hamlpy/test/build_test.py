@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamlpy import build
+
+class BuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        self._write('index.haml', '%p index')
+        self._write('nested/page.hamlpy', '%p page')
+        self._write('nested/notes.txt', 'not a template')
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.output_dir)
+
+    def _write(self, name, haml):
+        path = os.path.join(self.source_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(haml)
+
+    def _read(self, name):
+        with open(os.path.join(self.output_dir, name)) as f:
+            return f.read()
+
+    def _manifest(self):
+        with open(os.path.join(self.output_dir, build.MANIFEST_NAME)) as f:
+            return json.load(f)
+
+    def _build(self, **kwargs):
+        return build.build([self.source_dir], self.output_dir, **kwargs)
+
+    def test_compiles_all_templates(self):
+        self.assertEqual([], self._build())
+        self.assertEqual("<p>index</p>\n", self._read('index.html'))
+        self.assertEqual("<p>page</p>\n", self._read('nested/page.html'))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'nested', 'notes.html')))
+
+    def test_compiles_in_parallel(self):
+        for i in range(20):
+            self._write('many/%d.haml' % i, '%%p %d' % i)
+        self.assertEqual([], self._build(jobs=3))
+        for i in range(20):
+            self.assertEqual("<p>%d</p>\n" % i, self._read('many/%d.html' % i))
+
+    def test_manifest_maps_source_hashes_to_outputs(self):
+        self._build()
+        manifest = self._manifest()
+        entry = manifest['sources'][os.path.relpath(os.path.join(self.source_dir, 'index.haml'), self.output_dir)]
+        self.assertEqual('index.html', entry['output'])
+        self.assertEqual('index.html', manifest['artifacts'][entry['hash']])
+        self.assertEqual(2, len(manifest['artifacts']))
+
+    def test_up_to_date_templates_are_skipped(self):
+        self._build()
+        output_path = os.path.join(self.output_dir, 'index.html')
+        os.utime(output_path, (1000, 1000))
+
+        self._build()
+        self.assertEqual(1000, os.stat(output_path).st_mtime)
+
+    def test_changed_templates_are_rebuilt(self):
+        self._build()
+        self._write('index.haml', '%p changed')
+        os.utime(os.path.join(self.source_dir, 'index.haml'), (1000, 1000))
+
+        self._build()
+        self.assertEqual("<p>changed</p>\n", self._read('index.html'))
+
+    def test_changed_options_rebuild_everything(self):
+        self._write('index.haml', '%p.a index')
+        self._build()
+        self._build(options_dict={'attr_wrapper': '"'})
+        self.assertEqual('<p class="a">index</p>\n', self._read('index.html'))
+
+    def test_failures_are_reported(self):
+        self._write('broken.haml', '- endfor')
+        failures = self._build()
+
+        self.assertEqual(1, len(failures))
+        self.assertEqual(os.path.join(self.source_dir, 'broken.haml'), failures[0].task.source_path)
+        self.assertTrue('TypeError' in failures[0].error)
+        self.assertEqual("<p>index</p>\n", self._read('index.html'))
+
+    def test_templates_compiled_to_the_same_output_are_rejected(self):
+        other_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(other_dir, 'index.haml'), 'w') as f:
+                f.write('%p other')
+            try:
+                build.build([self.source_dir, other_dir], self.output_dir, jobs=2)
+            except build.BuildError, e:
+                self.assertTrue(os.path.join(self.source_dir, 'index.haml') in str(e))
+                self.assertTrue(os.path.join(other_dir, 'index.haml') in str(e))
+            else:
+                self.fail('no BuildError raised')
+            self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'index.html')))
+        finally:
+            shutil.rmtree(other_dir)
+
+    def test_extensions_compiled_to_the_same_output_are_rejected(self):
+        self._write('index.hamlpy', '%p other')
+        self.assertRaises(build.BuildError, self._build)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from hamlpy import nodes
+from hamlpy import cache
+from hamlpy.cache import cache_key, CompileCache, FileSystemBackend
+
+class DictBackend(object):
+    """
+    A cache backend keeping compiled templates in a dictionary
+    """
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, html):
+        self.store[key] = html
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_same_source_and_options_give_same_key(self):
+        self.assertEqual(cache_key(u'%p', {'attr_wrapper': '"'}), cache_key(u'%p', {'attr_wrapper': '"'}))
+
+    def test_key_depends_on_source(self):
+        self.assertNotEqual(cache_key(u'%p'), cache_key(u'%div'))
+
+    def test_key_depends_on_options(self):
+        self.assertNotEqual(cache_key(u'%p', {'attr_wrapper': '"'}), cache_key(u'%p', {'attr_wrapper': "'"}))
+
+    def test_key_depends_on_compiler_code(self):
+        key = cache_key(u'%p')
+        digest = cache.COMPILER_DIGEST
+        cache.COMPILER_DIGEST = 'other version'
+        try:
+            self.assertNotEqual(key, cache_key(u'%p'))
+        finally:
+            cache.COMPILER_DIGEST = digest
+
+    def test_key_depends_on_tag_tables(self):
+        key = cache_key(u'- macro foo')
+        nodes.TagNode.self_closing['macro'] = 'endmacro'
+        try:
+            self.assertNotEqual(key, cache_key(u'- macro foo'))
+        finally:
+            del nodes.TagNode.self_closing['macro']
+
+    def test_key_ignores_debug_tree(self):
+        self.assertEqual(cache_key(u'%p'), cache_key(u'%p', {'debug_tree': False}))
+
+    def test_default_options_give_same_key(self):
+        self.assertEqual(cache_key(u'%p'), cache_key(u'%p', {'attr_wrapper': u"'"}))
+
+class CompileCacheTest(unittest.TestCase):
+
+    def test_compiles_on_miss_and_reuses_on_hit(self):
+        compile_cache = CompileCache(DictBackend())
+        first = compile_cache.compile(u'%p hello')
+        second = compile_cache.compile(u'%p hello')
+
+        self.assertEqual(u"<p>hello</p>\n", first)
+        self.assertEqual(first, second)
+        self.assertEqual(1, compile_cache.misses)
+        self.assertEqual(1, compile_cache.hits)
+
+    def test_serves_html_stored_by_another_cache(self):
+        backend = DictBackend()
+        CompileCache(backend).compile(u'%p hello')
+        compile_cache = CompileCache(backend)
+        compile_cache.compile(u'%p hello')
+
+        self.assertEqual(1, compile_cache.hits)
+
+    def test_compile_function_is_called_on_misses(self):
+        compiled = []
+        def compile(source):
+            compiled.append(source)
+            return u'<p>compiled</p>'
+        compile_cache = CompileCache(DictBackend())
+        self.assertEqual(u'<p>compiled</p>', compile_cache.compile(u'%p hello', compile=compile))
+        self.assertEqual(u'<p>compiled</p>', compile_cache.compile(u'%p hello', compile=compile))
+        self.assertEqual([u'%p hello'], compiled)
+
+    def test_options_are_passed_to_compiler(self):
+        compile_cache = CompileCache(DictBackend())
+        self.assertEqual(u'<p class="a"></p>\n', compile_cache.compile(u'%p.a', {'attr_wrapper': '"'}))
+
+class FileSystemBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = FileSystemBackend(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_key_returns_none(self):
+        self.assertEqual(None, self.backend.get(cache_key(u'%p')))
+
+    def test_stored_html_can_be_read_back(self):
+        key = cache_key(u'%p')
+        self.backend.set(key, u'<p>é</p>')
+        self.assertEqual(u'<p>é</p>', self.backend.get(key))
+
+    def test_writes_leave_no_temporary_files(self):
+        key = cache_key(u'%p')
+        self.backend.set(key, u'<p></p>')
+        self.backend.set(key, u'<p></p>')
+        self.assertEqual([os.path.basename(self.backend.path(key))],
+                         os.listdir(os.path.dirname(self.backend.path(key))))
+
+    def test_concurrent_writers(self):
+        key = cache_key(u'%p')
+        errors = []
+
+        def write():
+            try:
+                for i in range(20):
+                    FileSystemBackend(self.directory).set(key, u'<p></p>')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(u'<p></p>', self.backend.get(key))
@@ -0,0 +1,89 @@
+import gc
+import time
+import unittest
+
+from hamlpy import hamlpy
+
+def siblings(n):
+    return '%ul\n' + '  %li> item\n' * n
+
+def multiline_attributes(n):
+    return "%div{'class': 'a',\n" + "     'data-x': 'y',\n" * n + "     'id': 'z'}"
+
+def nested_blocks(n):
+    # Every line has a parent a few levels up
+    block = ''.join(' ' * (2 * i) + '%div\n' for i in range(10))
+    return block * (n // 10)
+
+def if_else_chains(n):
+    return '- if a\n  a\n- elif b\n  b\n- else\n  c\n' * (n // 6)
+
+def quoted_attribute(n):
+    return "%a{'title': \"" + "it's {% trans 'x' %} " * n + "\"} text"
+
+def inline_variables(n):
+    return '%p\n' + '  #{a} and ={b} and \\#{c}\n' * n
+
+def filter_content(n):
+    return '%div\n  :javascript\n' + '    var a = {b: "c"};\n' * n
+
+class TestComplexity(unittest.TestCase):
+    '''Compiles inputs of two sizes, failing when doubling the size much more
+    than doubles the time'''
+
+    def _compile_time(self, haml):
+        compiler = hamlpy.Compiler()
+        # Collections of the nodes of earlier compiles would be timed too
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            compiler.process(haml)
+            return time.time() - start
+        finally:
+            gc.enable()
+
+    def _step_times(self, sources):
+        times = [[] for source in sources]
+        # Alternating the compiles keeps the machine slowing down for a while
+        # from making one of the sizes look slower
+        for i in range(3):
+            for source, source_times in zip(sources, times):
+                source_times.append(self._compile_time(source))
+        return [min(source_times) for source_times in times]
+
+    def _assert_linear(self, generate, size):
+        sources = [generate(size), generate(size * 2)]
+        attempts = []
+        # Quadratic time would be 4 times as long every time; a noisy
+        # measurement is taken again
+        for attempt in range(3):
+            times = self._step_times(sources)
+            if times[1] < times[0] * 3:
+                return
+            attempts.append(times)
+        self.fail('doubling the size took more than 3 times as long: %s' % attempts)
+
+    def test_siblings_removing_whitespace(self):
+        self._assert_linear(siblings, 8000)
+
+    def test_multiline_attributes(self):
+        self._assert_linear(multiline_attributes, 16000)
+
+    def test_nested_blocks(self):
+        self._assert_linear(nested_blocks, 4000)
+
+    def test_if_else_chains(self):
+        self._assert_linear(if_else_chains, 4800)
+
+    def test_quoted_attribute_value(self):
+        self._assert_linear(quoted_attribute, 16000)
+
+    def test_inline_variables(self):
+        self._assert_linear(inline_variables, 2000)
+
+    def test_filter_content(self):
+        self._assert_linear(filter_content, 8000)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from hamlpy import hamlpy
+from hamlpy.dependencies import DependencyIndex, template_key
+
+class DependencyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = DependencyIndex()
+        self.index.update('base.hamlpy', [])
+        self.index.update('layout.hamlpy', ['base.html', 'partials/nav.html'])
+        self.index.update('pages/page.hamlpy', ['layout.html'])
+        self.index.update('other.hamlpy', ['partials/nav.haml'])
+
+    def test_template_key_ignores_extension(self):
+        self.assertEqual(template_key('partials/nav.html'), template_key('partials/nav.hamlpy'))
+
+    def test_affected_templates_are_transitive(self):
+        self.assertEqual(set(['layout', 'pages/page']), self.index.affected('base.hamlpy'))
+        self.assertEqual(set(['layout', 'pages/page', 'other']), self.index.affected('partials/nav.hamlpy'))
+        self.assertEqual(set(), self.index.affected('pages/page.hamlpy'))
+
+    def test_update_replaces_dependencies(self):
+        self.index.update('layout.hamlpy', ['partials/nav.html'])
+        self.assertEqual(set(), self.index.affected('base.hamlpy'))
+        self.assertEqual(set(['layout', 'pages/page', 'other']), self.index.affected('partials/nav.hamlpy'))
+
+    def test_removed_template_no_longer_depends_on_others(self):
+        self.index.remove('other.hamlpy')
+        self.assertEqual(set(['layout', 'pages/page']), self.index.affected('partials/nav.hamlpy'))
+
+    def test_removed_template_is_still_depended_on(self):
+        self.index.remove('layout.hamlpy')
+        self.assertEqual(set(['pages/page']), self.index.affected('layout.hamlpy'))
+
+class FindDependenciesTest(unittest.TestCase):
+
+    def test_compiler_records_extends_and_include(self):
+        compiler = hamlpy.Compiler()
+        compiler.process('- extends "base.html"\n- block content\n  - include \'nav.haml\' with active=1\n  - include nav_template')
+        self.assertEqual(['base.html', 'nav.haml'], compiler.dependencies)
+
+    def test_find_dependencies_matches_compiler(self):
+        haml = ['- extends "base.html"', '-# - include "ignored.html"', '%p', '  - include "nav.html"']
+        compiler = hamlpy.Compiler()
+        compiler.process_lines(haml)
+        self.assertEqual(compiler.dependencies, hamlpy.find_dependencies(haml))
@@ -1,3 +1,4 @@
+import time
 import unittest
 from hamlpy import nodes
 
@@ -81,5 +82,118 @@ class TestElementNode(unittest.TestCase):
             self.assertEqual(root.parent_of(el['node']), eval(el['expected_parent']))
             root.add_node(el['node'])
 
+    def test_siblings(self):
+        root = nodes.RootNode()
+        items = [nodes.ElementNode('%li') for i in range(3)]
+        for item in items:
+            root.add_child(item)
+        self.assertEqual(None, items[0].left_sibling())
+        self.assertEqual(items[1], items[0].right_sibling())
+        self.assertEqual(items[0], items[1].left_sibling())
+        self.assertEqual(items[2], items[1].right_sibling())
+        self.assertEqual(None, items[2].right_sibling())
+
+        root.children.remove(items[0])
+        self.assertEqual(None, items[1].left_sibling())
+
+    def test_nodes_share_the_options_of_their_tree(self):
+        root = nodes.RootNode(attr_wrapper='"')
+        cursor = nodes.TreeCursor(root)
+        cursor.add_node(nodes.create_node('%div'))
+        cursor.add_node(nodes.create_node('  %p'))
+        div = root.children[0]
+        self.assertEqual('"', div.children[0].attr_wrapper)
+        self.assertTrue(div.options is root.options)
+        self.assertTrue(div.children[0].options is root.options)
+        self.assertFalse(hasattr(div, '__dict__'))
+
+    def test_rendered_elements_are_parsed_once(self):
+        parsed = []
+        parse_element = nodes.parse_element
+        def counting_parse_element(haml, attr_wrapper):
+            parsed.append(haml)
+            return parse_element(haml, attr_wrapper)
+
+        root = nodes.RootNode()
+        for i in range(3):
+            root.add_node(nodes.ElementNode("%%p{'data-n': '%d'}>" % i))
+        nodes.parse_element = counting_parse_element
+        try:
+            root.render()
+        finally:
+            nodes.parse_element = parse_element
+        self.assertEqual(3, len(parsed))
+
+    def _render_time(self, siblings):
+        root = nodes.RootNode()
+        cursor = nodes.TreeCursor(root)
+        cursor.add_node(nodes.create_node('%ul'))
+        for i in range(siblings):
+            cursor.add_node(nodes.create_node('  %li> item'))
+        start = time.time()
+        root.render()
+        return time.time() - start
+
+    def test_whitespace_removal_is_linear_in_siblings(self):
+        small = min(self._render_time(2000) for i in range(3))
+        large = min(self._render_time(16000) for i in range(3))
+        # 8 times the siblings; searching for each sibling would take 64 times as long
+        self.assertTrue(large < small * 24, (small, large))
+
+    def _nest(self, depth):
+        root = nodes.RootNode()
+        parent = root
+        for i in range(depth):
+            node = nodes.ElementNode('%p<' if i % 2 else '%div')
+            parent.add_child(node)
+            parent = node
+        return root
+
+    def test_nested_nodes_render_like_before(self):
+        self.assertEqual(self._nest(4).render(), '<div>\n<p><div>\n<p></p>\n</div></p>\n</div>\n')
+
+    def test_renders_trees_deeper_than_the_recursion_limit(self):
+        depth = 30000
+        html = self._nest(depth).render()
+        self.assertTrue(html.startswith('<div>\n<p><div>\n<p>'), html[:40])
+        self.assertEqual(html.count('<div>'), depth / 2)
+        self.assertEqual(html.count('</p>'), depth / 2)
+        self.assertEqual(len(self._nest(depth).debug_tree().splitlines()), depth + 1)
+
+    def test_add_node_in_deep_trees(self):
+        root = nodes.RootNode()
+        for i in range(1500):
+            root.add_node(nodes.create_node(' ' * i + '%p'))
+        self.assertEqual(root.parent_of(nodes.create_node(' ' * 1500 + '%p')).indentation, 1499)
+        self.assertTrue(root.parent_of(nodes.create_node('%p')) is root)
+
+class TestTreeCursor(unittest.TestCase):
+    def _build(self, lines):
+        root = nodes.RootNode()
+        cursor = nodes.TreeCursor(root)
+        for line in lines:
+            cursor.add_node(nodes.create_node(line))
+        return root
+
+    def test_inserts_nodes_like_add_node(self):
+        lines = ['%div', '  %p', '    %span', '  %p', '- if a', '  %b', '- elif b', '- else',
+                 '  - for x in y', '    %i', '  - empty', '%div', ' :javascript', '   %p',
+                 '     %p', '  %p', '%p']
+        root = nodes.RootNode()
+        for line in lines:
+            root.add_node(nodes.create_node(line))
+        self.assertEqual(root.debug_tree(), self._build(lines).debug_tree())
+
+    def test_knows_when_lines_are_inside_filter(self):
+        root = nodes.RootNode()
+        cursor = nodes.TreeCursor(root)
+        cursor.add_node(nodes.create_node('%div'))
+        cursor.add_node(nodes.create_node('  :css'))
+        self.assertTrue(cursor.inside_filter_node(4))
+        cursor.add_node(nodes.create_node('    a {'))
+        self.assertTrue(cursor.inside_filter_node(6))
+        self.assertFalse(cursor.inside_filter_node(2))
+        self.assertFalse(cursor.inside_filter_node(0))
+
 if __name__ == "__main__":
     unittest.main()
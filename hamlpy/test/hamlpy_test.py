@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import unittest
+from StringIO import StringIO
 from nose.tools import eq_, raises
 from hamlpy import hamlpy
 
@@ -295,6 +296,53 @@ class HamlPyTest(unittest.TestCase):
         result = hamlParser.process(haml)
         eq_(html, result)
 
+    def test_nested_whitespace_removal(self):
+        haml = '%div\n  %ul<\n    %li> a\n    text\n    %li>\n      %b< b\n  %p<\n    :plain\n      plain\n\n  %i> c'
+        html = '<div>\n  <ul><li>a</li>text<li>\n      <b>b</b>\n    </li></ul>\n  <p>plain</p><i>c</i></div>\n'
+        eq_(html, hamlpy.Compiler().process(haml))
+
+    def test_doctype_children_are_ignored(self):
+        eq_('<!DOCTYPE html>\n<p></p>\n', hamlpy.Compiler().process('!!! 5\n  %p<\n%p'))
+        eq_('<!DOCTYPE html>\n<p></p>\n', hamlpy.Compiler().process('!!! 5\n  -# note\n%p'))
+
+    def test_inline_variables_after_attributes(self):
+        haml = "%a{'href': '/'} #{name}\n%p{'class': 'x'}= value"
+        eq_("<a href='/'>{{ name }}</a>\n<p class='x'>{{ value }}</p>\n", hamlpy.Compiler().process(haml))
+
+    def test_deeply_nested_template(self):
+        depth = 3000
+        haml = '\n'.join(' ' * i + '%div' for i in range(depth))
+        result = hamlpy.Compiler().process(haml)
+        eq_(result.count('<div>'), depth)
+        eq_(result.count('</div>'), depth)
+        assert result.endswith('\n</div>\n')
+
+    def test_stream_yields_top_level_nodes(self):
+        haml = "- extends 'base.html'\n%p< a\n\n- if b\n  c\n- else\n  d\n%i> e\n%b f"
+        compiler = hamlpy.Compiler()
+        chunks = list(compiler.stream(haml.split('\n')))
+        eq_(chunks, ["{% extends 'base.html' %}\n", '<p>a</p>\n\n',
+                     '{% if b %}\n  c\n{% else %}\n  d\n{% endif %}', '<i>e</i>', '<b>f</b>\n'])
+        eq_(''.join(chunks), hamlpy.Compiler().process(haml))
+        eq_(compiler.dependencies, ['base.html'])
+
+    def test_stream_reads_lines_as_needed(self):
+        read = []
+        def lines():
+            for i in range(1000):
+                read.append(i)
+                yield '%%p %d\n' % i
+        chunks = hamlpy.Compiler().stream(lines())
+        eq_(next(chunks), '<p>0</p>\n')
+        eq_(len(read), 2)
+        eq_(len(list(chunks)), 999)
+
+    def test_stream_to_file(self):
+        haml_file = StringIO('%div\n  %p a\r\n\n%p b\n')
+        output = StringIO()
+        hamlpy.Compiler().stream_to(haml_file, output)
+        eq_(output.getvalue(), '<div>\n  <p>a</p>\n\n</div>\n<p>b</p>\n')
+
     def test_xml_namespaces(self):
         haml = "%fb:tag\n  content"
         html = "<fb:tag>\n  content\n</fb:tag>\n"
@@ -312,7 +360,7 @@ class HamlPyTest(unittest.TestCase):
         hamlParser = hamlpy.Compiler(options_dict={'attr_wrapper': '"'})
         result = hamlParser.process(haml)
         self.assertEqual(result,
-                         '''<html lang="en" xmlns="http://www.w3.org/1999/xhtml" xml:lang="en">
+                         '''<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
   <body id="main">
     <div class="wrap">
       <a href="/"></a>
@@ -0,0 +1,99 @@
+import time
+
+from nose.tools import eq_, raises
+
+from hamlpy import hamlpy, nodes
+from hamlpy.lexer import brace_depth, tokenize
+
+class TestLexer(object):
+
+    def test_tokens_have_kind_indentation_and_lines(self):
+        tokens = list(tokenize(['%div', '  - if a', '    = b', '', '  #{c} d']))
+        eq_([token.kind for token in tokens],
+            [nodes.ElementNode, nodes.TagNode, nodes.VariableNode, None, nodes.PlaintextNode])
+        eq_([token.indentation for token in tokens], [0, 2, 4, 0, 2])
+        eq_([(token.start, token.end) for token in tokens], [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)])
+
+    def test_multiline_attributes_make_one_token(self):
+        tokens = list(tokenize(['%p', "  %a{'href': '/',", "     'title': 'x'}", '%p']))
+        eq_(len(tokens), 3)
+        eq_(tokens[1].kind, nodes.ElementNode)
+        eq_(tokens[1].text, "  %a{'href': '/',     'title': 'x'}")
+        eq_((tokens[1].start, tokens[1].end), (2, 3))
+        eq_((tokens[2].start, tokens[2].end), (4, 4))
+
+    def test_filter_content_is_plain_text(self):
+        tokens = list(tokenize([':javascript', '  %div{', '', '  - endif', '%p']))
+        eq_([token.kind for token in tokens],
+            [nodes.JavascriptFilterNode, nodes.PlaintextNode, None, nodes.PlaintextNode, nodes.ElementNode])
+
+    def test_blank_lines_keep_filters_open(self):
+        tokens = list(tokenize(['  :plain', '    a', '', '    b', '  c']))
+        eq_([token.kind for token in tokens],
+            [nodes.PlainFilterNode, nodes.PlaintextNode, None, nodes.PlaintextNode, nodes.PlaintextNode])
+        eq_(tokens[-1].node().indentation, 2)
+
+    def test_closing_tags_in_filters_are_text(self):
+        haml = ':plain\n  - endif'
+        eq_(hamlpy.Compiler().process(haml), '- endif\n')
+
+    def test_node_kinds_match_create_node(self):
+        lines = ['%div', '.a', '#b', '#{c}', '={d}', '\\= e', '!!! 5', '/ f', '/[if IE]', '-# g',
+                 '=# h', '= i', '- for j in k', ':css', ':coffee', ':markdown', ':unknown', 'text']
+        for token in tokenize(lines):
+            eq_(token.kind, nodes.create_node(token.text).__class__)
+
+    @raises(Exception)
+    def test_unclosed_attributes_raise(self):
+        list(tokenize(["%a{'href': '/',", "  'title': 'x'"]))
+
+    def test_unclosed_attributes_report_first_line(self):
+        try:
+            list(tokenize(['%p', "%a{'b': 'c',", "  'd': 'e'}", "%a{'f': 'g',"]))
+        except Exception, e:
+            eq_(str(e), 'No closing brace found for multi-line HAML beginning at line 4')
+        else:
+            assert False, 'no exception raised'
+
+    def test_brace_depth_ignores_braces_in_strings(self):
+        eq_(brace_depth("%a{'title': '}',"), (1, None))
+        eq_(brace_depth("%a{'title': \"{{ x }}\", 'b': '\\'{'}"), (0, None))
+        eq_(brace_depth("%p don't {"), (1, None))
+        eq_(brace_depth("  'title': 'a", 1, None), (1, "'"))
+        eq_(brace_depth("b}'}", 1, "'"), (0, None))
+
+    def test_braces_in_strings_of_multiline_attributes(self):
+        haml = "%a{'title': '}',\n   'href': '{% url home %}'}\n%p"
+        eq_(hamlpy.Compiler().process(haml), "<a title='}' href='{% url home %}'></a>\n<p></p>\n")
+
+    def test_open_variables_do_not_continue_lines(self):
+        tokens = list(tokenize(['%p {{ x', '%p b', 'It is {{ a', '%p']))
+        eq_([(token.start, token.end) for token in tokens], [(1, 1), (2, 2), (3, 3), (4, 4)])
+        eq_(hamlpy.Compiler().process('It is {{ a\n%p'), 'It is {{ a\n<p></p>\n')
+
+    def test_nested_braces_of_multiline_attributes(self):
+        tokens = list(tokenize(['%a{', "'b': {", "'c': 1}", '}', '%p']))
+        eq_([(token.start, token.end) for token in tokens], [(1, 4), (5, 5)])
+
+    def test_large_attribute_block(self):
+        lines = ['%div{'] + ["  'data-a%d': 'x{}%d'," % (i, i) for i in range(2000)] + ['}', '%p']
+        tokens = list(tokenize(lines))
+        eq_(len(tokens), 2)
+        eq_((tokens[0].start, tokens[0].end), (1, 2002))
+        eq_(tokens[0].text, ''.join(lines[:-1]))
+
+        html = hamlpy.Compiler().process('\n'.join(lines))
+        assert "data-a1999='x{}1999'" in html
+        assert html.endswith('<p></p>\n')
+
+    def test_attribute_blocks_are_scanned_in_linear_time(self):
+        def scan_time(count):
+            lines = ['%div{'] + ["  'data-a%d': '{x}'," % i for i in range(count)] + ['}']
+            start = time.time()
+            list(tokenize(lines))
+            return time.time() - start
+
+        small = min(scan_time(5000) for _ in range(3))
+        large = min(scan_time(40000) for _ in range(3))
+        # 8 times the lines; a quadratic scan would take 64 times as long
+        assert large < small * 24, (small, large)
@@ -1,5 +1,8 @@
 import unittest
 import sys
+import os
+import shutil
+import tempfile
 
 try:
   from django.conf import settings
@@ -8,7 +11,10 @@ try:
 except ImportError, e:
   pass
 
-from hamlpy.template.loaders import get_haml_loader, TemplateDoesNotExist
+from hamlpy import build, metrics
+from hamlpy.cache import CompileCache, FileSystemBackend
+from hamlpy.template import loaders
+from hamlpy.template.loaders import get_haml_loader, get_prebuilt_haml_loader, TemplateDoesNotExist
 
 class DummyLoader(object):
     """
@@ -27,6 +33,22 @@ class DummyLoader(object):
         except KeyError:
             raise TemplateDoesNotExist(template_name)
 
+class FileLoader(object):
+    """
+    A template loader that reads templates from a single directory
+    """
+    directory = None
+
+    def __init__(self, *args, **kwargs):
+        self.Loader = self.__class__
+
+    def load_template_source(self, template_name, *args, **kwargs):
+        path = os.path.join(self.directory, template_name)
+        try:
+            return (open(path).read(), path)
+        except IOError:
+            raise TemplateDoesNotExist(template_name)
+
 class LoaderTest(unittest.TestCase):
     """
     Tests for the django template loader.
@@ -72,3 +94,270 @@ class LoaderTest(unittest.TestCase):
         # we expect an exception since the extension is not supported by
         # the loader
         self._test_assert_exception('loader_test.txt')
+
+class CompileCacheTest(unittest.TestCase):
+    """
+    Tests for the cache of compiled templates shared by the hamlpy loaders.
+    """
+
+    def setUp(self):
+        loaders.compile_cache.clear()
+        FileLoader.directory = tempfile.mkdtemp()
+        self.hamlpy_loader = get_haml_loader(FileLoader())()
+
+    def tearDown(self):
+        shutil.rmtree(FileLoader.directory)
+
+    def _write_template(self, name, haml, mtime):
+        path = os.path.join(FileLoader.directory, name)
+        with open(path, 'w') as f:
+            f.write(haml)
+        os.utime(path, (mtime, mtime))
+
+    def test_unchanged_template_is_served_from_cache(self):
+        self._write_template('cached.haml', '%p hello', 1000)
+
+        first, _ = self.hamlpy_loader.load_template_source('cached.haml')
+        second, _ = self.hamlpy_loader.load_template_source('cached.haml')
+
+        self.assertEqual("<p>hello</p>\n", first)
+        self.assertEqual(first, second)
+        self.assertEqual(1, loaders.compile_cache.misses)
+        self.assertEqual(1, loaders.compile_cache.hits)
+
+    def test_changed_template_is_recompiled(self):
+        self._write_template('cached.haml', '%p hello', 1000)
+        self.hamlpy_loader.load_template_source('cached.haml')
+
+        self._write_template('cached.haml', '%p goodbye', 2000)
+        html, _ = self.hamlpy_loader.load_template_source('cached.haml')
+
+        self.assertEqual("<p>goodbye</p>\n", html)
+        self.assertEqual(2, loaders.compile_cache.misses)
+        self.assertEqual(0, loaders.compile_cache.hits)
+
+    def test_templates_without_a_file_are_keyed_by_source(self):
+        hamlpy_loader = get_haml_loader(DummyLoader())()
+        hamlpy_loader.load_template_source('loader_test.hamlpy')
+        hamlpy_loader.load_template_source('loader_test.hamlpy')
+
+        self.assertEqual(1, loaders.compile_cache.hits)
+
+    def test_cache_is_bounded(self):
+        cache = loaders.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+        self.assertEqual(2, len(cache))
+
+class PrebuiltLoaderTest(unittest.TestCase):
+    """
+    Tests for the loader serving templates compiled by hamlpy-build.
+    """
+
+    def setUp(self):
+        loaders.compile_cache.clear()
+        FileLoader.directory = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        self._write_template('prebuilt.haml', '%p hello')
+        build.build([FileLoader.directory], self.output_dir)
+        # Mark the artifact so the tests can tell it apart from live compilation
+        with open(os.path.join(self.output_dir, 'prebuilt.html'), 'w') as f:
+            f.write('<p>prebuilt</p>')
+
+        manifest_path = os.path.join(self.output_dir, build.MANIFEST_NAME)
+        self.hamlpy_loader = get_prebuilt_haml_loader(FileLoader(), manifest_path)()
+
+    def tearDown(self):
+        shutil.rmtree(FileLoader.directory)
+        shutil.rmtree(self.output_dir)
+
+    def _write_template(self, name, haml):
+        with open(os.path.join(FileLoader.directory, name), 'w') as f:
+            f.write(haml)
+
+    def test_serves_prebuilt_artifact(self):
+        html, path = self.hamlpy_loader.load_template_source('prebuilt.haml')
+        self.assertEqual('<p>prebuilt</p>', html)
+        self.assertEqual(os.path.join(FileLoader.directory, 'prebuilt.haml'), path)
+
+    def test_compiles_template_changed_since_build(self):
+        self._write_template('prebuilt.haml', '%p changed')
+        html, _ = self.hamlpy_loader.load_template_source('prebuilt.haml')
+        self.assertEqual("<p>changed</p>\n", html)
+
+    def test_compiles_template_missing_from_build(self):
+        self._write_template('new.haml', '%p new')
+        html, _ = self.hamlpy_loader.load_template_source('new.haml')
+        self.assertEqual("<p>new</p>\n", html)
+
+    def test_compiles_template_when_artifact_is_missing(self):
+        os.remove(os.path.join(self.output_dir, 'prebuilt.html'))
+        html, _ = self.hamlpy_loader.load_template_source('prebuilt.haml')
+        self.assertEqual("<p>hello</p>\n", html)
+
+    def test_compiles_templates_without_manifest(self):
+        hamlpy_loader = get_prebuilt_haml_loader(FileLoader())()
+        html, _ = hamlpy_loader.load_template_source('prebuilt.haml')
+        self.assertEqual("<p>hello</p>\n", html)
+
+    def test_artifact_is_read_once(self):
+        self.hamlpy_loader.load_template_source('prebuilt.haml')
+        os.remove(os.path.join(self.output_dir, 'prebuilt.html'))
+        html, _ = self.hamlpy_loader.load_template_source('prebuilt.haml')
+        self.assertEqual('<p>prebuilt</p>', html)
+        self.assertEqual(1, loaders.compile_cache.hits)
+
+    def test_artifacts_are_kept_apart_from_compiled_html(self):
+        get_haml_loader(FileLoader())().load_template_source('prebuilt.haml')
+        html, _ = self.hamlpy_loader.load_template_source('prebuilt.haml')
+        self.assertEqual('<p>prebuilt</p>', html)
+
+class LoaderMetricsTest(unittest.TestCase):
+    """
+    Tests for the metrics recorded by the hamlpy loaders.
+    """
+
+    def setUp(self):
+        loaders.compile_cache.clear()
+        self.sink = metrics.PrometheusSink()
+        metrics.add_sink(self.sink)
+        self.hamlpy_loader = get_haml_loader(DummyLoader())()
+
+    def tearDown(self):
+        metrics.remove_sink(self.sink)
+
+    def test_compiles_are_counted(self):
+        self.hamlpy_loader.load_template_source('loader_test.hamlpy')
+        self.hamlpy_loader.load_template_source('loader_test.hamlpy')
+
+        # The second load is a cache hit, not a compile
+        self.assertEqual(1, self.sink.counter('hamlpy_compiles_total', loader='DummyLoader'))
+        self.assertEqual(1, self.sink.histogram('hamlpy_compile_seconds', loader='DummyLoader')[1])
+        self.assertEqual((19, 1), self.sink.histogram('hamlpy_source_bytes', loader='DummyLoader'))
+        self.assertEqual(1, self.sink.counter('hamlpy_compile_cache_misses_total'))
+        self.assertEqual(1, self.sink.counter('hamlpy_compile_cache_hits_total'))
+
+    def test_templates_in_the_persistent_cache_are_not_timed(self):
+        cache_dir = tempfile.mkdtemp()
+        shared_cache = CompileCache(FileSystemBackend(cache_dir))
+        shared_cache.compile(DummyLoader.templates['loader_test.hamlpy'], loaders.options_dict)
+        previous, loaders.persistent_cache = loaders.persistent_cache, shared_cache
+        try:
+            self.hamlpy_loader.load_template_source('loader_test.hamlpy')
+        finally:
+            loaders.persistent_cache = previous
+            shutil.rmtree(cache_dir)
+
+        self.assertEqual(1, shared_cache.hits)
+        self.assertEqual(0, self.sink.counter('hamlpy_compiles_total', loader='DummyLoader'))
+        self.assertEqual(1, self.sink.counter('hamlpy_compile_cache_misses_total'))
+
+    def test_templates_not_found_are_counted(self):
+        for template_name in ('not_in_dict.hamlpy', 'in_dict.txt', 'page.html'):
+            self.assertRaises(TemplateDoesNotExist, self.hamlpy_loader.load_template_source, template_name)
+
+        self.assertEqual(3, self.sink.counter('hamlpy_template_not_found_total', loader='DummyLoader'))
+        self.assertEqual(0, self.sink.counter('hamlpy_compiles_total', loader='DummyLoader'))
+
+    def test_failures_are_counted(self):
+        DummyLoader.templates['broken.hamlpy'] = "%a{'href': '/',"
+        try:
+            self.assertRaises(Exception, self.hamlpy_loader.load_template_source, 'broken.hamlpy')
+        finally:
+            del DummyLoader.templates['broken.hamlpy']
+        self.assertEqual(1, self.sink.counter('hamlpy_compile_failures_total', loader='DummyLoader'))
+
+    def test_prebuilt_loaders_are_named_apart(self):
+        hamlpy_loader = get_prebuilt_haml_loader(DummyLoader())()
+        hamlpy_loader.load_template_source('loader_test.hamlpy')
+        self.assertEqual(1, self.sink.counter('hamlpy_compiles_total', loader='prebuilt_DummyLoader'))
+
+class ProbingFileLoader(FileLoader):
+    """
+    A FileLoader counting the templates it looks for, and telling where
+    """
+    probes = 0
+
+    def load_template_source(self, template_name, *args, **kwargs):
+        ProbingFileLoader.probes += 1
+        return FileLoader.load_template_source(self, template_name, *args, **kwargs)
+
+    def get_template_sources(self, template_name, *args, **kwargs):
+        yield os.path.join(self.directory, template_name)
+
+class MissCacheTest(unittest.TestCase):
+    """
+    Tests for the cache of templates the hamlpy loaders do not have.
+    """
+
+    def setUp(self):
+        loaders.compile_cache.clear()
+        ProbingFileLoader.probes = 0
+        FileLoader.directory = tempfile.mkdtemp()
+        self.hamlpy_loader = get_haml_loader(ProbingFileLoader())()
+
+    def tearDown(self):
+        shutil.rmtree(FileLoader.directory)
+
+    def _assert_missing(self, template_name):
+        self.assertRaises(TemplateDoesNotExist, self.hamlpy_loader.load_template_source, template_name)
+
+    def _write_template(self, name, haml):
+        with open(os.path.join(FileLoader.directory, name), 'w') as f:
+            f.write(haml)
+        # Make sure the directory looks changed, whatever the mtime resolution
+        os.utime(FileLoader.directory, (1000, 1000))
+
+    def test_repeated_misses_are_answered_from_memory(self):
+        for i in range(3):
+            self._assert_missing('missing.haml')
+        self.assertEqual(1, ProbingFileLoader.probes)
+
+    def test_misses_are_kept_per_template_and_arguments(self):
+        self._assert_missing('missing.haml')
+        self._assert_missing('other.haml')
+        self.assertRaises(TemplateDoesNotExist, self.hamlpy_loader.load_template_source, 'missing.haml', ['dir'])
+        self._assert_missing('missing.haml')
+        self.assertEqual(3, ProbingFileLoader.probes)
+
+    def test_other_extensions_are_not_looked_for(self):
+        self._assert_missing('page.html')
+        self.assertEqual(0, ProbingFileLoader.probes)
+        self.assertEqual(0, len(self.hamlpy_loader.miss_cache))
+
+    def test_misses_are_trusted_while_directories_are_unchanged(self):
+        self.hamlpy_loader.miss_cache = loaders.MissCache(ttl=0)
+        self._assert_missing('missing.haml')
+        self._assert_missing('missing.haml')
+        self.assertEqual(1, ProbingFileLoader.probes)
+
+        self._write_template('missing.haml', '%p found')
+        html, _ = self.hamlpy_loader.load_template_source('missing.haml')
+        self.assertEqual("<p>found</p>\n", html)
+        self.assertEqual(2, ProbingFileLoader.probes)
+
+    def test_misses_without_directories_expire(self):
+        hamlpy_loader = get_haml_loader(DummyLoader())()
+        hamlpy_loader.miss_cache = loaders.MissCache(ttl=0)
+        self.assertRaises(TemplateDoesNotExist, hamlpy_loader.load_template_source, 'added.hamlpy')
+
+        DummyLoader.templates['added.hamlpy'] = '%p added'
+        try:
+            html, _ = hamlpy_loader.load_template_source('added.hamlpy')
+        finally:
+            del DummyLoader.templates['added.hamlpy']
+        self.assertEqual("<p>added</p>\n", html)
+
+    def test_miss_cache_is_bounded(self):
+        self.hamlpy_loader.miss_cache = loaders.MissCache(max_entries=2)
+        for name in ('a.haml', 'b.haml', 'c.haml'):
+            self._assert_missing(name)
+        self.assertEqual(2, len(self.hamlpy_loader.miss_cache))
+        self._assert_missing('a.haml')
+        self.assertEqual(4, ProbingFileLoader.probes)
@@ -0,0 +1,78 @@
+import logging
+import unittest
+
+from hamlpy import metrics
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = metrics.PrometheusSink()
+        metrics.add_sink(self.sink)
+
+    def tearDown(self):
+        metrics.remove_sink(self.sink)
+
+    def test_nothing_is_recorded_without_sinks(self):
+        metrics.remove_sink(self.sink)
+        self.assertEqual('<p></p>', metrics.timed_compile('test', lambda source: '<p></p>', '%p'))
+        self.assertEqual('', self.sink.dump())
+
+    def test_timed_compile(self):
+        html = metrics.timed_compile('test', lambda source, path: u'<p>\xe9</p>', u'%p \xe9', 'test.haml')
+        self.assertEqual(u'<p>\xe9</p>', html)
+        self.assertEqual(1, self.sink.counter('hamlpy_compiles_total', loader='test'))
+        self.assertEqual(1, self.sink.histogram('hamlpy_compile_seconds', loader='test')[1])
+        self.assertEqual((5, 1), self.sink.histogram('hamlpy_source_bytes', loader='test'))
+        self.assertEqual((9, 1), self.sink.histogram('hamlpy_output_bytes', loader='test'))
+
+    def test_timed_compile_failure(self):
+        def fail(source):
+            raise ValueError(source)
+        self.assertRaises(ValueError, metrics.timed_compile, 'test', fail, '%p')
+        self.assertEqual(1, self.sink.counter('hamlpy_compile_failures_total', loader='test'))
+        self.assertEqual(0, self.sink.counter('hamlpy_compiles_total', loader='test'))
+
+    def test_prometheus_dump(self):
+        sink = metrics.PrometheusSink(buckets={'hamlpy_compile_seconds': (0.1, 1.0)})
+        sink.increment('hamlpy_compiles_total', {'loader': 'filesystem'})
+        sink.increment('hamlpy_compiles_total', {'loader': 'filesystem'})
+        sink.increment('hamlpy_compiles_total', {'loader': 'a "b"'})
+        sink.observe('hamlpy_compile_seconds', {'loader': 'filesystem'}, 0.05)
+        sink.observe('hamlpy_compile_seconds', {'loader': 'filesystem'}, 0.5)
+        sink.observe('hamlpy_compile_seconds', {'loader': 'filesystem'}, 2.0)
+        self.assertEqual('''\
+# HELP hamlpy_compiles_total HamlPy templates compiled, not taken from a cache
+# TYPE hamlpy_compiles_total counter
+hamlpy_compiles_total{loader="a \\"b\\""} 1
+hamlpy_compiles_total{loader="filesystem"} 2
+# HELP hamlpy_compile_seconds Time taken to compile HamlPy templates
+# TYPE hamlpy_compile_seconds histogram
+hamlpy_compile_seconds_bucket{loader="filesystem",le="0.1"} 1
+hamlpy_compile_seconds_bucket{loader="filesystem",le="1.0"} 2
+hamlpy_compile_seconds_bucket{loader="filesystem",le="+Inf"} 3
+hamlpy_compile_seconds_sum{loader="filesystem"} 2.55
+hamlpy_compile_seconds_count{loader="filesystem"} 3
+''', sink.dump())
+
+    def test_logging_sink(self):
+        handler = ListHandler()
+        logger = logging.getLogger('hamlpy.test.metrics')
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        sink = metrics.LoggingSink(logger)
+        sink.increment('hamlpy_compiles_total', {'loader': 'filesystem'})
+        sink.observe('hamlpy_output_bytes', {'loader': 'filesystem'}, 120)
+        self.assertEqual(['hamlpy_compiles_total{loader="filesystem"} +1',
+                          'hamlpy_output_bytes{loader="filesystem"} 120'], handler.messages)
+
+    def test_load_sink(self):
+        self.assertTrue(isinstance(metrics.load_sink('hamlpy.metrics.PrometheusSink'), metrics.PrometheusSink))
+        self.assertTrue(metrics.load_sink(self.sink) is self.sink)
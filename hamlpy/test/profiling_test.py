@@ -0,0 +1,74 @@
+from nose.tools import eq_
+
+from hamlpy import hamlpy
+from hamlpy.profiling import CompileStats
+
+HAML = '''\
+%div
+  - if a
+    %a{'href': '/'} link
+
+  :plain
+    text
+%p= b'''
+
+class TestProfiling(object):
+
+    def _compile(self, haml, **kwargs):
+        collected = []
+        html = hamlpy.Compiler(on_stats=collected.append, **kwargs).process(haml)
+        eq_(len(collected), 1)
+        return html, collected[0]
+
+    def test_stats_do_not_change_the_html(self):
+        html, stats = self._compile(HAML)
+        eq_(html, hamlpy.Compiler().process(HAML))
+
+    def test_phases(self):
+        html, stats = self._compile(HAML)
+        eq_(stats.phases.keys(), ['tokenize', 'build', 'nodes', 'generate'])
+        assert all(elapsed >= 0 for elapsed in stats.phases.values()), stats.phases
+        eq_(stats.total, sum(stats.phases.values()))
+
+    def test_node_counts_and_times(self):
+        html, stats = self._compile(HAML)
+        eq_(stats.node_counts, {'ElementNode': 3, 'TagNode': 1, 'PlainFilterNode': 1, 'PlaintextNode': 1})
+        # Filter content is rendered by its filter
+        eq_(sorted(stats.node_times), ['ElementNode', 'PlainFilterNode', 'TagNode'])
+
+    def test_slowest_nodes_have_line_numbers(self):
+        html, stats = self._compile(HAML)
+        slowest = stats.slowest_nodes
+        eq_(sorted((line, name, source) for elapsed, line, name, source in slowest), [
+            (1, 'ElementNode', '%div'),
+            (2, 'TagNode', '- if a'),
+            (3, 'ElementNode', "%a{'href': '/'} link"),
+            (5, 'PlainFilterNode', ':plain'),
+            (7, 'ElementNode', '%p= b'),
+        ])
+        eq_(slowest, sorted(slowest, reverse=True))
+
+    def test_number_of_slowest_nodes_is_bounded(self):
+        stats = CompileStats(slowest=2)
+        compiler = hamlpy.Compiler()
+        root = compiler._build_tree(hamlpy.tokenize(HAML.split('\n')), stats.lines)
+        root.render(stats.render_node)
+        eq_(len(stats.slowest_nodes), 2)
+
+    def test_stats_are_reported_for_every_template(self):
+        collected = []
+        compiler = hamlpy.Compiler(on_stats=collected.append)
+        compiler.process('%p')
+        compiler.process('%p\n%p')
+        eq_([stats.node_counts for stats in collected], [{'ElementNode': 1}, {'ElementNode': 2}])
+
+    def test_stats_drop_the_tree(self):
+        html, stats = self._compile(HAML)
+        eq_(stats.lines, {})
+
+    def test_report(self):
+        html, stats = self._compile(HAML)
+        report = stats.report()
+        assert 'tokenize' in report
+        assert 'PlainFilterNode' in report
+        assert "line 3 " in report
@@ -1,6 +1,7 @@
-from nose.tools import eq_
+from nose.tools import eq_, raises
 
-from hamlpy.elements import Element
+from hamlpy import elements
+from hamlpy.elements import Element, parse_element
 
 class TestElement(object):
 
@@ -49,7 +50,70 @@ class TestElement(object):
             eq_(s1['b'],None)
             eq_(s1['c'],2)
 
-            eq_(sut.attributes, "a='something' c='2' b")
+            eq_(sut.attributes, "a='something' b c='2'")
+
+        def test_attributes_parse_ruby_style(self):
+            sut = Element('')
+            s1 = sut._parse_attribute_dictionary('''{:href => '/', "title" => "Home", :checked => None}''')
+            eq_(s1['href'], '/')
+            eq_(s1['title'], 'Home')
+            eq_(s1['checked'], None)
+
+        def test_attributes_parse_literals(self):
+            sut = Element('')
+            s1 = sut._parse_attribute_dictionary('''{'a': -1.5, 'b': True, 'c': 'x' "y", 'd': u'\\xc3\\xa9', 'class': ('p', 'q'), 'id': ('r'),}''')
+            eq_(s1['a'], -1.5)
+            eq_(s1['b'], True)
+            eq_(s1['c'], 'xy')
+            eq_(s1['d'], u'\xe9')
+            eq_(s1['class'], ('p', 'q'))
+            eq_(s1['id'], 'r')
+
+        def test_attributes_keep_their_source_order(self):
+            sut = Element('''%a{'title': 'x', 'href': '/', 'data-b': 2, 'data-a': 1, 'title': 'y'}''')
+            # A repeated key keeps its first place and takes its last value
+            eq_(sut.attributes, "title='y' href='/' data-b='2' data-a='1'")
+
+        @raises(Exception)
+        def test_attributes_do_not_run_code(self):
+            Element('''%a{'href': __import__('os').getcwd()}''')
+
+        @raises(Exception)
+        def test_attributes_must_be_one_dictionary(self):
+            Element('''%a{'href': '/'}{b}''')
+
+        def test_inline_content_can_have_braces(self):
+            sut = Element('''%a{'href': '/', 'title': '}'} #{name} {b}''')
+            eq_(sut.attributes, "href='/' title='}'")
+            eq_(sut.inline_content, '#{name} {b}')
+
+        def test_escape_quotes_in_unterminated_django_tag(self):
+            sut = Element('')
+            eq_(sut._escape_attribute_quotes("it's {% url 'a'"), "it\\'s {% url 'a'")
+            eq_(sut._escape_attribute_quotes("{%}'{%%}'"), "{%}\\'{%%}\\'")
+
+        def test_splits_all_parts(self):
+            parts = Element.split_haml("%fb:like#i.a.b{'x': '}'}></= text")
+            eq_(parts, {'tag': '%fb:like', 'id': '#i', 'class': '.a.b', 'attributes': "{'x': '}'}",
+                        'nuke_outer_whitespace': '>', 'nuke_inner_whitespace': '<', 'selfclose': '/',
+                        'django': '=', 'inline': ' text'})
+
+            # Attributes run to the brace closing them
+            parts = Element.split_haml("%p{'x': {'y': '}'}} text {y}")
+            eq_(parts['attributes'], "{'x': {'y': '}'}}")
+            eq_(parts['inline'], ' text {y}')
+
+            parts = Element.split_haml("%p.a{'x': 1}<= var")
+            eq_(parts['attributes'], "{'x': 1}")
+            eq_(parts['nuke_inner_whitespace'], '<')
+            eq_(parts['django'], '=')
+            eq_(parts['inline'], ' var')
+
+        def test_unclosed_brace_is_not_attributes(self):
+            parts = Element.split_haml("%p{ text")
+            eq_(parts['tag'], '%p')
+            eq_(parts['attributes'], '')
+            eq_(parts['inline'], '')
 
         def test_pulls_tag_name_off_front(self):
             sut = Element('%div.class')
@@ -137,3 +201,29 @@ class TestElement(object):
             assert "href='/long/url/to/stylesheet/resource.css'" in sut.attributes
             assert "type='text/css'" in sut.attributes
             assert "rel='stylesheet'" in sut.attributes
+
+        def test_parse_element_reuses_parsed_headers(self):
+            first = parse_element("%div.a{'b': 'c'} text")
+            assert parse_element("%div.a{'b': 'c'} text") is first
+            assert parse_element("%div.a{'b': 'c'} text", '"') is not first
+            eq_(parse_element("%div.a{'b': 'c'} text", '"').attributes, 'b="c"')
+
+        def test_parse_element_cache_is_bounded(self):
+            size = elements.ELEMENT_CACHE_SIZE
+            elements.ELEMENT_CACHE_SIZE = 10
+            try:
+                for i in range(25):
+                    parse_element('%%p.c%d' % i)
+                assert len(elements._element_cache) <= 10
+            finally:
+                elements.ELEMENT_CACHE_SIZE = size
+
+        def test_parse_element_follows_self_closing_tags(self):
+            tags = Element.self_closing_tags
+            assert not parse_element('%custom').self_close
+            Element.self_closing_tags = tags + ('custom',)
+            try:
+                assert parse_element('%custom').self_close
+            finally:
+                Element.self_closing_tags = tags
+            assert not parse_element('%custom').self_close
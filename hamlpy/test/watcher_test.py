@@ -0,0 +1,301 @@
+import ctypes
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from hamlpy import hamlpy_watcher
+from hamlpy import inotify
+
+class WatcherTest(unittest.TestCase):
+    """
+    Tests for the hamlpy-watcher compilation of changed files.
+    """
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        hamlpy_watcher.compiled.clear()
+        hamlpy_watcher.dependency_index = hamlpy_watcher.DependencyIndex()
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+        shutil.rmtree(self.output_dir)
+        hamlpy_watcher.compiled.clear()
+        hamlpy_watcher.Options.JOBS = 1
+        hamlpy_watcher._close_pool()
+
+    def _write(self, name, haml, mtime=None):
+        path = os.path.join(self.input_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(haml)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def _read(self, name):
+        with open(os.path.join(self.output_dir, name)) as f:
+            return f.read()
+
+    def test_scan_compiles_new_and_changed_files(self):
+        self._write('a.hamlpy', '%p a', 1000)
+        self._write('sub/b.hamlpy', '%p b', 1000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self.assertEqual("<p>a</p>\n", self._read('a.html'))
+        self.assertEqual("<p>b</p>\n", self._read('sub/b.html'))
+
+        self._write('a.hamlpy', '%p changed', 2000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self.assertEqual("<p>changed</p>\n", self._read('a.html'))
+
+    def test_reported_changes_are_compiled(self):
+        path = self._write('sub/a.hamlpy', '%p a')
+        hamlpy_watcher._compile_changed([path, os.path.join(self.input_dir, 'ignored.txt')],
+                                        self.input_dir, self.output_dir, {})
+        self.assertEqual("<p>a</p>\n", self._read('sub/a.html'))
+        self.assertEqual([path], list(hamlpy_watcher.compiled))
+
+    def test_reported_deletions_are_forgotten(self):
+        path = self._write('sub/a.hamlpy', '%p a')
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        shutil.rmtree(os.path.dirname(path))
+
+        hamlpy_watcher._compile_changed([os.path.dirname(path)], self.input_dir, self.output_dir, {})
+        self.assertEqual({}, hamlpy_watcher.compiled)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'sub', 'a.html')))
+
+    def test_scan_deletes_output_of_removed_files(self):
+        path = self._write('a.hamlpy', '%p a')
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        os.remove(path)
+
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self.assertEqual({}, hamlpy_watcher.compiled)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'a.html')))
+
+    def test_dependencies_are_indexed_while_compiling(self):
+        self._write('base.hamlpy', '%p base', 1000)
+        self._write('sub/page.hamlpy', '- extends "base.html"', 1000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self.assertEqual(set(['sub/page']), hamlpy_watcher.dependency_index.affected('base.hamlpy'))
+
+        self._write('sub/page.hamlpy', '%p standalone', 2000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self.assertEqual(set(), hamlpy_watcher.dependency_index.affected('base.hamlpy'))
+
+    def _restart(self, compiler_args={}):
+        hamlpy_watcher.compiled.clear()
+        hamlpy_watcher.dependency_index = hamlpy_watcher.DependencyIndex()
+        hamlpy_watcher._load_state(self.input_dir, self.output_dir, compiler_args)
+
+    def _mark_outputs(self):
+        for name in ('a.html', 'b.html'):
+            os.utime(os.path.join(self.output_dir, name), (1000, 1000))
+
+    def _output_mtime(self, name):
+        return os.stat(os.path.join(self.output_dir, name)).st_mtime
+
+    def test_state_survives_restart(self):
+        self._write('a.hamlpy', '%p a', 1000)
+        self._write('b.hamlpy', '- extends "a.html"', 1000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self._mark_outputs()
+
+        self._restart()
+        self.assertEqual(set(['b']), hamlpy_watcher.dependency_index.affected('a.hamlpy'))
+
+        self._write('b.hamlpy', '%p b', 2000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self.assertEqual(1000, self._output_mtime('a.html'))
+        self.assertNotEqual(1000, self._output_mtime('b.html'))
+
+    def test_touched_files_are_not_recompiled(self):
+        self._write('a.hamlpy', '%p a', 1000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        os.utime(os.path.join(self.output_dir, 'a.html'), (1000, 1000))
+
+        self._restart()
+        os.utime(os.path.join(self.input_dir, 'a.hamlpy'), (3000, 3000))
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self.assertEqual(1000, self._output_mtime('a.html'))
+        self.assertEqual(3000, hamlpy_watcher.compiled[os.path.join(self.input_dir, 'a.hamlpy')]['mtime'])
+
+    def test_changed_options_discard_state(self):
+        self._write('a.hamlpy', '%p.x a', 1000)
+        self._write('b.hamlpy', '%p.x b', 1000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self._mark_outputs()
+
+        self._restart({'attr_wrapper': '"'})
+        self.assertEqual({}, hamlpy_watcher.compiled)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {'attr_wrapper': '"'})
+        self.assertNotEqual(1000, self._output_mtime('a.html'))
+        self.assertNotEqual(1000, self._output_mtime('b.html'))
+
+    def test_changed_tags_discard_state(self):
+        self._write('a.hamlpy', '%p a', 1000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+
+        hamlpy_watcher.hamlpynodes.TagNode.self_closing['macro'] = 'endmacro'
+        try:
+            self._restart()
+        finally:
+            del hamlpy_watcher.hamlpynodes.TagNode.self_closing['macro']
+        self.assertEqual({}, hamlpy_watcher.compiled)
+
+    def _watch_folder_output(self):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_batches_are_compiled_by_worker_pool(self):
+        hamlpy_watcher.Options.JOBS = 2
+        for i in range(6):
+            self._write('sub%d/t%d.hamlpy' % (i % 2, i), '- extends "base.html"\n%%p %d' % i)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+
+        for i in range(6):
+            self.assertEqual("{%% extends \"base.html\" %%}\n<p>%d</p>\n" % i, self._read('sub%d/t%d.html' % (i % 2, i)))
+        self.assertEqual(set(['sub0/t0', 'sub0/t2', 'sub0/t4', 'sub1/t1', 'sub1/t3', 'sub1/t5']),
+                         hamlpy_watcher.dependency_index.affected('base.html'))
+
+    def test_failures_are_reported_after_the_batch(self):
+        hamlpy_watcher.Options.JOBS = 2
+        self._write('a.hamlpy', '%p a')
+        self._write('b.hamlpy', '%p{ broken')
+        self._write('c.hamlpy', '%p\xff')
+        self._write('d.hamlpy', '%p d')
+        output = self._watch_folder_output()
+
+        self.assertEqual(2, output.count('Failed to compile'))
+        self.assertTrue(output.index('b.hamlpy') < output.index('c.hamlpy'))
+        self.assertEqual("<p>a</p>\n", self._read('a.html'))
+        self.assertEqual("<p>d</p>\n", self._read('d.html'))
+        self.assertEqual(None, hamlpy_watcher.compiled[os.path.join(self.input_dir, 'b.hamlpy')]['hash'])
+
+    def test_identical_output_is_not_rewritten(self):
+        self._write('a.hamlpy', '%p a', 1000)
+        self._write('b.hamlpy', '%p b', 1000)
+        hamlpy_watcher._watch_folder(self.input_dir, self.output_dir, {})
+        self._mark_outputs()
+
+        self._write('a.hamlpy', '%p   a', 2000)
+        self._write('b.hamlpy', '%p c', 2000)
+        hamlpy_watcher.Options.VERBOSE = True
+        try:
+            output = self._watch_folder_output()
+        finally:
+            hamlpy_watcher.Options.VERBOSE = False
+        self.assertEqual(1000, self._output_mtime('a.html'))
+        self.assertEqual("<p>c</p>\n", self._read('b.html'))
+        self.assertTrue('wrote 1, unchanged 1, failed 0' in output)
+        self.assertEqual([], [name for name in os.listdir(self.output_dir) if name.endswith('.tmp')])
+
+    def test_running_out_of_watches_falls_back_to_polling(self):
+        closed = []
+        class FullInotify(object):
+            def add_tree(self, folder):
+                raise inotify.InotifyUnavailable('No space left on device')
+            def close(self):
+                closed.append(True)
+
+        real_inotify = inotify.Inotify
+        inotify.Inotify = FullInotify
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            # Returns, so the polling loop takes over
+            hamlpy_watcher._watch_events(self.input_dir, self.output_dir, {})
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            inotify.Inotify = real_inotify
+        self.assertEqual([True], closed)
+        self.assertTrue('Falling back to polling' in output)
+
+class InotifyTest(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            self.watcher = inotify.Inotify()
+        except inotify.InotifyUnavailable:
+            raise unittest.SkipTest('inotify is not available')
+        self.folder = tempfile.mkdtemp()
+        self.watcher.add_tree(self.folder)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.folder)
+
+    def test_reports_created_modified_and_deleted_files(self):
+        path = os.path.join(self.folder, 'a.haml')
+        with open(path, 'w') as f:
+            f.write('%p')
+        self.assertEqual(set([path]), self.watcher.wait(settle=0.01))
+
+        os.remove(path)
+        self.assertEqual(set([path]), self.watcher.wait(settle=0.01))
+
+    def test_coalesces_bursts_of_events(self):
+        path = os.path.join(self.folder, 'a.haml')
+        for i in range(10):
+            with open(path, 'w') as f:
+                f.write('%p')
+        self.assertEqual(set([path]), self.watcher.wait(settle=0.01))
+        self.assertEqual(set(), self.watcher.read(0))
+
+    def test_watches_new_folders(self):
+        folder = os.path.join(self.folder, 'sub')
+        os.mkdir(folder)
+        self.watcher.wait(settle=0.01)
+
+        path = os.path.join(folder, 'a.haml')
+        with open(path, 'w') as f:
+            f.write('%p')
+        self.assertEqual(set([path]), self.watcher.wait(settle=0.01))
+
+    def test_reports_files_moved_in(self):
+        outside = tempfile.mkdtemp()
+        try:
+            source = os.path.join(outside, 'a.haml')
+            with open(source, 'w') as f:
+                f.write('%p')
+            target = os.path.join(self.folder, 'a.haml')
+            os.rename(source, target)
+            self.assertEqual(set([target]), self.watcher.wait(settle=0.01))
+        finally:
+            shutil.rmtree(outside)
+
+    def test_names_are_decoded_in_unicode_trees(self):
+        self.watcher.close()
+        self.watcher = inotify.Inotify()
+        self.watcher.encoding = 'utf-8'
+        folder = self.folder.decode('utf-8')
+        self.watcher.add_tree(folder)
+
+        with open(os.path.join(self.folder, 'caf\xc3\xa9.haml'), 'w') as f:
+            f.write('%p')
+        self.assertEqual(set([os.path.join(folder, u'caf\xe9.haml')]), self.watcher.wait(settle=0.01))
+
+        # Not utf-8, so there is no unicode path for it
+        with open(os.path.join(self.folder, 'caf\xe9.haml'), 'w') as f:
+            f.write('%p')
+        self.assertEqual(set(), self.watcher.wait(settle=0.01))
+
+    def test_watch_limit_is_reported_as_unavailable(self):
+        class FullLibc(object):
+            def inotify_add_watch(self, fd, path, mask):
+                ctypes.set_errno(errno.ENOSPC)
+                return -1
+
+        self.watcher._libc = FullLibc()
+        self.assertRaises(inotify.InotifyUnavailable, self.watcher.add_tree, self.folder)
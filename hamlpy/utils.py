@@ -0,0 +1,108 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def atomic_write(path, text, encoding='utf-8'):
+    '''Writes text to path through a temporary file in the same directory, so
+    concurrent readers see either the old or the new contents, never a mix'''
+    directory = os.path.dirname(path) or '.'
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another process may have created it in the meantime
+            if not os.path.isdir(directory):
+                raise
+
+    if isinstance(text, unicode):
+        text = text.encode(encoding)
+
+    try:
+        mode = os.stat(path).st_mode & 0777
+    except OSError:
+        mode = 0644
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(text)
+        # mkstemp creates files readable by their owner only
+        os.chmod(temp_path, mode)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Windows refuses to rename over an existing file
+            os.remove(path)
+            os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_if_changed(path, text, encoding='utf-8'):
+    '''Atomically writes text to path unless the file already has exactly
+    that content, so tools watching the output don't see spurious changes.
+    Returns True if the file was written.'''
+    if isinstance(text, unicode):
+        text = text.encode(encoding)
+    try:
+        with open(path, 'rb') as existing:
+            unchanged = hashlib.sha1(existing.read()).digest() == hashlib.sha1(text).digest()
+    except IOError:
+        unchanged = False
+    if unchanged:
+        return False
+    atomic_write(path, text)
+    return True
+
+
+class LRUCache(object):
+    '''Bounded, thread-safe mapping that evicts the least recently used entry when full'''
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Re-insert so the entry becomes the most recently used one
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
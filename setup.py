@@ -15,6 +15,7 @@ setup(name='hamlpy',
       ],
       entry_points = {
           'console_scripts' : ['hamlpy = hamlpy.hamlpy:convert_files',
-                               'hamlpy-watcher = hamlpy.hamlpy_watcher:watch_folder']
+                               'hamlpy-watcher = hamlpy.hamlpy_watcher:watch_folder',
+                               'hamlpy-build = hamlpy.build:build_templates']
       }
     )